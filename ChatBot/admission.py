@@ -0,0 +1,174 @@
+"""
+Admission control for chat requests.
+
+A global limit caps how many turns call the model at once. Requests over the
+limit wait in a bounded queue; once the queue is full new requests are
+rejected straight away so the API can answer 429 instead of piling work onto
+the model. Turns for the same session additionally run strictly one after
+another, in arrival order, so concurrent requests cannot lose each other's
+messages.
+"""
+
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted; `retry_after` is in seconds"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class SessionLock:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.refs = 0
+
+
+class Permit:
+    """A granted turn; releasing it frees the model slot and the session"""
+
+    def __init__(self, controller: "AdmissionController", session_id: str, holds_slot: bool):
+        self._controller = controller
+        self.session_id = session_id
+        self.holds_slot = holds_slot
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        self._controller._release(self)
+
+
+class AdmissionController:
+    """Global concurrency limit with a bounded wait queue and per-session ordering"""
+
+    def __init__(self, max_concurrent: int = 32, max_queue: int = 64, queue_timeout: float = 30.0):
+        # max_concurrent=0 disables the global limit; queue_timeout=0 waits forever
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_concurrent) if max_concurrent else None
+        self._sessions: Dict[str, SessionLock] = {}
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.avg_service = 1.0  # exponentially weighted, seeds Retry-After
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """Build a controller from CHAT_MAX_CONCURRENT / CHAT_MAX_QUEUE / CHAT_QUEUE_TIMEOUT"""
+        return cls(
+            max_concurrent=int(os.getenv('CHAT_MAX_CONCURRENT', '32')),
+            max_queue=int(os.getenv('CHAT_MAX_QUEUE', '64')),
+            queue_timeout=float(os.getenv('CHAT_QUEUE_TIMEOUT', '30')),
+        )
+
+    def retry_after(self) -> int:
+        """Seconds until the queue ahead of a new request has likely drained"""
+        rounds = (self.waiting + 1) / (self.max_concurrent or 1)
+        return max(1, math.ceil(rounds * self.avg_service))
+
+    def check(self):
+        """Raise Overloaded if every slot is taken and the queue is full"""
+        if self._slots is not None and self._slots.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded("queue_full", self.retry_after())
+
+    async def acquire(self, session_id: str, use_slot: bool = True) -> Permit:
+        """Wait for the session's turn and, with `use_slot`, a model slot"""
+        if use_slot:
+            self.check()
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            entry = self._sessions[session_id] = SessionLock()
+        entry.refs += 1
+        self.waiting += 1
+        start = time.monotonic()
+        has_session = has_slot = False
+        try:
+            async with asyncio.timeout(self.queue_timeout or None):
+                await entry.lock.acquire()
+                has_session = True
+                if use_slot and self._slots is not None:
+                    await self._slots.acquire()
+                    has_slot = True
+        except TimeoutError:
+            self.timed_out += 1
+            raise Overloaded("queue_timeout", self.retry_after()) from None
+        finally:
+            self.waiting -= 1
+            if not has_session or (use_slot and self._slots is not None and not has_slot):
+                if has_session:
+                    entry.lock.release()
+                self._unref(session_id, entry)
+
+        waited = time.monotonic() - start
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self.admitted += 1
+        if use_slot:
+            self.active += 1
+        return Permit(self, session_id, use_slot)
+
+    @asynccontextmanager
+    async def admit(self, session_id: str):
+        """Hold a model slot and the session for the duration of a turn"""
+        permit = await self.acquire(session_id)
+        try:
+            yield permit
+        finally:
+            permit.release()
+
+    @asynccontextmanager
+    async def session(self, session_id: str):
+        """Hold only the session, e.g. to change its history between turns"""
+        permit = await self.acquire(session_id, use_slot=False)
+        try:
+            yield permit
+        finally:
+            permit.release()
+
+    def stats(self) -> dict:
+        """Queue depth and wait times for sizing workers"""
+        return {
+            'active': self.active,
+            'queued': self.waiting,
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'avg_wait_seconds': self.total_wait / self.admitted if self.admitted else 0.0,
+            'max_wait_seconds': self.max_wait,
+            'sessions_locked': len(self._sessions),
+        }
+
+    def _release(self, permit: Permit):
+        if permit.holds_slot:
+            self.active -= 1
+            elapsed = time.monotonic() - permit.started
+            self.avg_service = 0.9 * self.avg_service + 0.1 * elapsed
+            if self._slots is not None:
+                self._slots.release()
+        entry = self._sessions[permit.session_id]
+        entry.lock.release()
+        self._unref(permit.session_id, entry)
+
+    def _unref(self, session_id: str, entry: SessionLock):
+        entry.refs -= 1
+        if entry.refs == 0 and self._sessions.get(session_id) is entry:
+            del self._sessions[session_id]
@@ -0,0 +1,29 @@
+"""
+Session-to-worker affinity for multi-process serving (see cluster.py).
+
+A session is owned by worker `crc32(session_id) % workers`. The hash is
+stable across processes and restarts, unlike Python's salted `hash()`.
+Workers learn their position from CHAT_WORKER_INDEX / CHAT_WORKER_COUNT and
+only issue session ids that hash back to themselves, so a conversation that
+started on a worker without a session id keeps coming back to it.
+"""
+
+import os
+import uuid
+import zlib
+
+WORKER_INDEX = int(os.getenv('CHAT_WORKER_INDEX', '0'))
+WORKER_COUNT = int(os.getenv('CHAT_WORKER_COUNT', '1'))
+
+
+def worker_for(session_id: str, workers: int) -> int:
+    """Index of the worker owning `session_id`"""
+    return zlib.crc32(session_id.encode()) % workers
+
+
+def new_session_id(index: int = WORKER_INDEX, workers: int = WORKER_COUNT) -> str:
+    """A fresh session id owned by worker `index` (about `workers` draws on average)"""
+    while True:
+        session_id = str(uuid.uuid4())
+        if workers <= 1 or worker_for(session_id, workers) == index:
+            return session_id
@@ -1,77 +1,334 @@
 import os
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.graph import StateGraph, START, END
-from typing import TypedDict, Literal, Annotated
+from typing import TypedDict, Literal, Annotated, Optional
 from pydantic import BaseModel, Field
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 from langgraph.graph import add_messages
-from langgraph.checkpoint.memory import MemorySaver
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
-from fastapi.middleware.cors import CORSMiddleware
-import json
+from langchain_core.runnables import RunnableConfig
 import asyncio
+import threading
+import time
+from session_store import SessionStore
+from context_window import ContextWindow
+from response_cache import ResponseCache, cache_key
+from single_flight import SingleFlight
+from metrics import Timer, upstream_latency, upstream_errors
+from resilience import UpstreamPolicy
+from graph_tracing import GraphTracer, instrument
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Get API key from environment variables
-GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-if not GOOGLE_API_KEY:
-    raise ValueError("GOOGLE_API_KEY environment variable not set. Please create a .env file with your API key.")
+# Model provider: "gemini" (default) or "fake" for offline load testing
+MODEL_PROVIDER = os.getenv('CHAT_MODEL_PROVIDER', 'gemini').lower()
 
-model = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash", 
-    api_key=GOOGLE_API_KEY,
-    temperature=0.5, 
-    max_tokens=90000,
-    streaming=True  # Enable streaming
-)
+def build_gemini_model():
+    """Build the Google Gemini chat model"""
+    # Imported here: the Gemini SDK dominates import time and is not needed
+    # until the first model call
+    from langchain_google_genai import ChatGoogleGenerativeAI
 
-class ChatState(TypedDict):
+    # Get API key from environment variables
+    google_api_key = os.getenv('GOOGLE_API_KEY')
+    if not google_api_key:
+        raise ValueError("GOOGLE_API_KEY environment variable not set. Please create a .env file with your API key.")
+
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.0-flash", 
+        api_key=google_api_key,
+        temperature=0.5, 
+        max_tokens=90000,
+        streaming=True  # Enable streaming
+    )
+
+def build_fake_model():
+    """Build the deterministic offline model configured by FAKE_LLM_* variables"""
+    from fake_llm import FakeStreamingChatModel
+    return FakeStreamingChatModel.from_env()
+
+MODEL_PROVIDERS = {
+    'gemini': build_gemini_model,
+    'fake': build_fake_model,
+}
+
+def build_model(provider: str = MODEL_PROVIDER):
+    """Build the chat model for the configured provider"""
+    if provider not in MODEL_PROVIDERS:
+        raise ValueError(f"Unknown CHAT_MODEL_PROVIDER '{provider}'. Choose one of: {', '.join(MODEL_PROVIDERS)}")
+    return MODEL_PROVIDERS[provider]()
+
+# The model is built on first use so importing this module stays fast;
+# main.py warms it up in the background after startup
+_model = None
+_model_lock = threading.Lock()
+model_load_seconds = None
+
+def get_model():
+    """Return the configured chat model, building it on first use"""
+    global _model, model_load_seconds
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                start = time.perf_counter()
+                _model = build_model()
+                model_load_seconds = time.perf_counter() - start
+    return _model
+
+def model_loaded() -> bool:
+    return _model is not None
+
+class ChatState(TypedDict, total=False):
     messages: Annotated[list[BaseMessage], Field(description="List of messages in the chat"), add_messages]
-    
-def chat_node(state: ChatState):
+    summary: Annotated[str, Field(description="Running summary of messages older than the context window")]
+    summarized: Annotated[int, Field(description="Number of leading messages covered by the summary")]
+
+context_window = ContextWindow.from_env()
+response_cache = ResponseCache.from_env()
+inflight_requests = SingleFlight()
+# Deadlines, retries, hedging and the circuit breaker for every model call
+upstream = UpstreamPolicy.from_env()
+
+# Long-term memory: "none" (default, the model sees the summary plus every
+# unsummarized turn) or "vector" for a per-session embedding index that adds
+# only the most relevant earlier turns to a fixed recent window
+MEMORY = os.getenv('CHAT_MEMORY', 'none').lower()
+
+def build_memory(kind: str = MEMORY):
+    """Build the long-term memory, or None to send the context window as is"""
+    if kind == 'none':
+        return None
+    if kind == 'vector':
+        from vector_memory import VectorMemory
+        return VectorMemory.from_env()
+    raise ValueError(f"Unknown CHAT_MEMORY '{kind}'. Choose one of: none, vector")
+
+long_term_memory = build_memory()
+
+# Upstream call metrics, resolved once so the hot path only does arithmetic
+CHAT_LATENCY, CHAT_ERRORS = upstream_latency.labels('chat'), upstream_errors.labels('chat')
+SUMMARY_LATENCY, SUMMARY_ERRORS = upstream_latency.labels('summary'), upstream_errors.labels('summary')
+
+# Optional coalescing of small stream chunks into fewer SSE frames (0 = off)
+STREAM_COALESCE_SECONDS = float(os.getenv('CHAT_STREAM_COALESCE_MS', '0')) / 1000
+STREAM_COALESCE_CHARS = int(os.getenv('CHAT_STREAM_COALESCE_CHARS', '0'))
+
+def model_cache_key(messages: list[BaseMessage]) -> str:
+    """Response-cache key for sending `messages` to the configured model"""
+    model = get_model()
+    return cache_key(messages, getattr(model, 'model', type(model).__name__), getattr(model, 'temperature', None))
+
+def summary_is_stale(state: ChatState) -> bool:
+    return context_window.is_stale(state['messages'], state.get('summary', ''), state.get('summarized', 0))
+
+def context_messages(state: ChatState, session_id: Optional[str] = None) -> list[BaseMessage]:
+    """What the model sees: the running summary plus the recent turns verbatim"""
+    if long_term_memory is not None and session_id is not None:
+        return long_term_memory.build_context(session_id, state['messages'], state.get('summary', ''), state.get('summarized', 0))
+    return context_window.build_context(state['messages'], state.get('summary', ''), state.get('summarized', 0))
+
+async def summarize_node(state: ChatState):
+    """Fold turns that no longer fit the token budget into the running summary"""
+    summarized = state.get('summarized', 0)
+    fold_to = context_window.fold_point(state['messages'], summarized)
+    prompt = context_window.summary_prompt(state.get('summary', ''), state['messages'][summarized:fold_to])
+
+    async def invoke():
+        try:
+            with Timer(SUMMARY_LATENCY):
+                return await get_model().ainvoke(prompt)
+        except Exception:
+            SUMMARY_ERRORS.inc()
+            raise
+
+    response = await upstream.call(invoke, 'summary')
+    return {'summary': response.content, 'summarized': fold_to}
+
+def route_context(state: ChatState) -> Literal['summarize_node', 'chat_node']:
+    """Only re-summarize when the cached summary has gone stale"""
+    return 'summarize_node' if state['messages'] and summary_is_stale(state) else 'chat_node'
+
+async def chat_node(state: ChatState, config: RunnableConfig):
+    """Call the model without blocking the event loop"""
     if not state['messages']:
-        state['messages'] = [HumanMessage(content="Hello, how can I assist you today?")]
-    else:
-        response = model.invoke(state['messages'])
-        state['messages'].append(AIMessage(content=response.content))
-    
-    return {'messages': state['messages']}
+        return {'messages': [HumanMessage(content="Hello, how can I assist you today?")]}
 
-async def stream_chat_response(messages):
-    """Simple streaming function that directly streams from the model"""
-    full_response = ""
+    context = context_messages(state, config.get('configurable', {}).get('thread_id'))
+    key = model_cache_key(context)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return {'messages': [AIMessage(content=cached.text)]}
+
+    content = "".join([chunk async for chunk in coalesced_model_chunks(context, key)])
+    return {'messages': [AIMessage(content=content)]}
+
+async def prepare_context(state: ChatState, session_id: Optional[str] = None):
+    """Refresh a stale summary outside the graph (used by streaming); returns (state, context)"""
+    if summary_is_stale(state):
+        state = {**state, **await summarize_node(state)}
+    return state, context_messages(state, session_id)
+
+async def cached_chunks(entry):
+    """Replay a cached response as if it were being streamed"""
+    for content in entry.chunks:
+        yield content
+
+async def model_chunks(messages):
+    """Stream content from the model (one attempt)"""
+    start = time.perf_counter()
     try:
-        # Use the streaming capability of the model directly
-        async for chunk in model.astream(messages):
+        async for chunk in get_model().astream(messages):
             if hasattr(chunk, 'content') and chunk.content:
-                content = chunk.content
-                full_response += content
-                yield {
-                    'partial': True,
-                    'chunk': content,
-                    'full_response': full_response
-                }
+                yield chunk.content
+    except Exception:
+        CHAT_ERRORS.inc()
+        raise
+    CHAT_LATENCY.observe(time.perf_counter() - start)
+
+def coalesced_model_chunks(messages, key):
+    """Model chunks for `messages`, sharing one upstream call between identical in-flight requests"""
+    return inflight_requests.subscribe(
+        key,
+        lambda: upstream.stream(lambda: model_chunks(messages), 'chat'),
+        on_complete=lambda chunks: response_cache.put(key, chunks)
+    )
+
+async def coalesce_chunks(source, max_delay: float = 0.0, max_chars: int = 0):
+    """Merge small chunks until `max_chars` are buffered or `max_delay` seconds have passed"""
+    if not (max_delay or max_chars):
+        async for chunk in source:
+            yield chunk
+        return
+
+    loop = asyncio.get_running_loop()
+    buffer, size, deadline, pending = [], 0, 0.0, None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(source.__anext__())
+            timeout = max(0.0, deadline - loop.time()) if buffer and max_delay else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # The upstream stalled: flush what we have and keep waiting
+                yield "".join(buffer)
+                buffer, size = [], 0
+                continue
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                pending = None
+                break
+            pending = None
+            if not buffer:
+                deadline = loop.time() + max_delay
+            buffer.append(chunk)
+            size += len(chunk)
+            if (max_chars and size >= max_chars) or (max_delay and loop.time() >= deadline):
+                yield "".join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+async def stream_chat_response(messages):
+    """Stream the answer for `messages` from the model or the response cache"""
+    key = model_cache_key(messages)
+    cached = response_cache.get(key)
+    parts = []
+    try:
+        source = cached_chunks(cached) if cached is not None else coalesced_model_chunks(messages, key)
+        async for content in coalesce_chunks(source, STREAM_COALESCE_SECONDS, STREAM_COALESCE_CHARS):
+            parts.append(content)
+            yield {
+                'partial': True,
+                'chunk': content
+            }
         
         # Send final completion signal
         yield {
             'partial': False,
-            'full_response': full_response
+            'full_response': "".join(parts)
         }
         
     except Exception as e:
         yield {
             'error': True,
-            'message': str(e)
+            'message': str(e),
+            'retry_after': getattr(e, 'retry_after', None)
         }
 
-checkpointer = MemorySaver()
-    
+# Durable checkpointer: "none" (default, history lives only in the session
+# store) or "sqlite" to survive restarts
+CHECKPOINTER = os.getenv('CHAT_CHECKPOINTER', 'none').lower()
+
+def build_checkpointer(kind: str = CHECKPOINTER):
+    """Build the durable checkpointer, or None for in-memory only"""
+    if kind == 'none':
+        return None
+    if kind == 'sqlite':
+        from sqlite_checkpointer import SQLiteCheckpointer
+        return SQLiteCheckpointer.from_env()
+    raise ValueError(f"Unknown CHAT_CHECKPOINTER '{kind}'. Choose one of: none, sqlite")
+
+# Bounded store for all conversation history. With a durable checkpointer it
+# acts as a hot cache; sessions missing from it are loaded lazily from disk
+session_store = SessionStore.from_env()
+checkpointer = build_checkpointer()
+
 graph = StateGraph(ChatState)
+graph.add_node('summarize_node', summarize_node)
 graph.add_node('chat_node', chat_node)
-graph.add_edge(START, 'chat_node')
+graph.add_conditional_edges(START, route_context)
+graph.add_edge('summarize_node', 'chat_node')
 graph.add_edge('chat_node', END)
 chatbot = graph.compile(checkpointer=checkpointer, name="ChatBot")
+
+# Optional per-node timing, exported to CHAT_TRACE_DIR as OTLP/JSON files
+graph_tracer = GraphTracer.from_env()
+if graph_tracer is not None:
+    chatbot = instrument(chatbot, graph_tracer)
+
+def thread_config(session_id: str) -> dict:
+    return {"configurable": {"thread_id": session_id}}
+
+async def load_session(session_id: str):
+    """Return a session's ChatState, or None if the session is unknown"""
+    state = session_store.get(session_id)
+    if state is None and checkpointer is not None:
+        snapshot = await chatbot.aget_state(thread_config(session_id))
+        if snapshot.values.get('messages'):
+            state = dict(snapshot.values)
+            session_store.put(session_id, state)
+    return state
+
+async def load_history(session_id: str):
+    """Return a session's history as compact records, or None if the session is unknown"""
+    history = session_store.get_history(session_id)
+    if history is None and await load_session(session_id) is not None:
+        history = session_store.get_history(session_id)
+    return history
+
+async def save_turn(session_id: str, state: ChatState, new_messages):
+    """Record messages produced outside the graph (e.g. by streaming)"""
+    # add_messages assigns ids, so the checkpointer can merge them later
+    state = {**state, 'messages': add_messages(state.get('messages', []), new_messages)}
+    session_store.put(session_id, state)
+    if checkpointer is not None:
+        update = {'messages': new_messages}
+        if 'summary' in state:
+            update.update(summary=state['summary'], summarized=state['summarized'])
+        await chatbot.aupdate_state(thread_config(session_id), update, as_node='chat_node')
+    return state
+
+async def delete_history(session_id: str) -> bool:
+    """Forget a session everywhere; returns False if it did not exist"""
+    found = session_store.delete(session_id)
+    if long_term_memory is not None:
+        long_term_memory.delete(session_id)
+    if checkpointer is not None:
+        snapshot = await chatbot.aget_state(thread_config(session_id))
+        found = found or bool(snapshot.values.get('messages'))
+        await checkpointer.adelete_thread(session_id)
+    return found
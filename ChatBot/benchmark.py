@@ -0,0 +1,704 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the ChatBot API
+
+Starts the API with the offline fake model (see fake_llm.py) unless --url
+points at an already running server, then drives concurrent sessions
+through /chat and /chat/stream and reports latency percentiles.
+
+Usage:
+    python benchmark.py load --sessions 50 --turns 5
+    python benchmark.py load --url http://localhost:8000 --endpoint stream
+    python benchmark.py eventloop --requests 200
+    python benchmark.py checkpointer --sessions 50 --turns 20
+    python benchmark.py streamcpu --tokens 2000
+    python benchmark.py scaling --workers 1,2,4
+    python benchmark.py memory --sessions 100000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+
+try:
+    import psutil
+except ImportError:  # RSS reporting is optional
+    psutil = None
+
+HERE = Path(__file__).resolve().parent
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def summarize(values, scale=1000.0):
+    """p50/p95/p99/max of a list of seconds, reported in milliseconds"""
+    if not values:
+        return {}
+    return {
+        'p50': round(percentile(values, 50) * scale, 2),
+        'p95': round(percentile(values, 95) * scale, 2),
+        'p99': round(percentile(values, 99) * scale, 2),
+        'max': round(max(values) * scale, 2),
+    }
+
+
+def rss_bytes(pid):
+    """Resident set size of a process, or None when it cannot be read"""
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def fake_model_env(args):
+    """Environment for a server process running the fake model"""
+    env = dict(os.environ)
+    env.update({
+        'CHAT_MODEL_PROVIDER': 'fake',
+        'FAKE_LLM_TOKENS_PER_SECOND': str(args.tokens_per_second),
+        'FAKE_LLM_LATENCY': str(args.latency),
+        'FAKE_LLM_RESPONSE_TOKENS': str(args.response_tokens),
+        'FAKE_LLM_FAILURE_RATE': str(args.failure_rate),
+        'FAKE_LLM_TAIL_RATE': str(args.tail_rate),
+        'FAKE_LLM_TAIL_LATENCY': str(args.tail_latency),
+    })
+    # Measure the serving path, not cache hits, unless the caller opts in
+    env.setdefault('CHAT_RESPONSE_CACHE_SIZE', '0')
+    return env
+
+
+class ServerProcess:
+    """uvicorn running main:app with the fake model, for the duration of a benchmark"""
+
+    def __init__(self, port, env, extra_args=()):
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.env = env
+        self.extra_args = list(extra_args)
+        self.process = None
+
+    def command(self):
+        return [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                "--port", str(self.port), "--log-level", "warning", *self.extra_args]
+
+    def __enter__(self):
+        self.process = subprocess.Popen(self.command(), cwd=HERE, env=self.env)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("Server exited during startup")
+            try:
+                if httpx.get(f"{self.url}/health", timeout=1).status_code == 200:
+                    return self
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+        self.__exit__(None, None, None)
+        raise RuntimeError("Server did not become healthy within 30s")
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+
+class ClusterProcess(ServerProcess):
+    """cluster.py serving main:app from several workers behind the affinity router"""
+
+    def __init__(self, port, env, workers):
+        super().__init__(port, env)
+        self.workers = workers
+
+    def command(self):
+        return [sys.executable, "cluster.py", "--workers", str(self.workers), "--port", str(self.port),
+                "--log-level", "warning"]
+
+
+async def run_chat_turn(client, url, session_id, message, stats):
+    start = time.perf_counter()
+    try:
+        response = await client.post(f"{url}/chat", json={"message": message, "session_id": session_id})
+        response.raise_for_status()
+    except httpx.HTTPError:
+        stats['errors'] += 1
+        return
+    stats['latency'].append(time.perf_counter() - start)
+
+
+async def run_stream_turn(client, url, session_id, message, stats):
+    start = time.perf_counter()
+    first_chunk = None
+    chunks = 0
+    try:
+        async with client.stream("POST", f"{url}/chat/stream",
+                                 json={"message": message, "session_id": session_id}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[6:])
+                if event.get('type') == 'chunk':
+                    chunks += 1
+                    if first_chunk is None:
+                        first_chunk = time.perf_counter() - start
+                elif event.get('type') == 'error':
+                    stats['errors'] += 1
+                    return
+    except httpx.HTTPError:
+        stats['errors'] += 1
+        return
+    stats['latency'].append(time.perf_counter() - start)
+    if first_chunk is not None:
+        stats['ttfc'].append(first_chunk)
+    stats['chunks'] += chunks
+
+
+async def drive_sessions(url, endpoint, sessions, turns, timeout):
+    """Run `sessions` concurrent conversations of `turns` turns each"""
+    stats = {'latency': [], 'ttfc': [], 'chunks': 0, 'errors': 0}
+    run_turn = run_stream_turn if endpoint == 'stream' else run_chat_turn
+    limits = httpx.Limits(max_connections=sessions, max_keepalive_connections=sessions)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def session(index):
+            session_id = str(uuid.uuid4())
+            for turn in range(turns):
+                await run_turn(client, url, session_id, f"Session {index} question {turn}", stats)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(session(i) for i in range(sessions)))
+        stats['elapsed'] = time.perf_counter() - start
+    return stats
+
+
+def load_report(endpoint, stats, sessions, turns, rss_before, rss_after):
+    elapsed = stats['elapsed']
+    report = {
+        'endpoint': endpoint,
+        'sessions': sessions,
+        'turns': turns,
+        'requests': len(stats['latency']),
+        'errors': stats['errors'],
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_s': round(len(stats['latency']) / elapsed, 2) if elapsed else None,
+        'latency_ms': summarize(stats['latency']),
+    }
+    if endpoint == 'stream':
+        report['ttfc_ms'] = summarize(stats['ttfc'])
+        report['chunks'] = stats['chunks']
+        report['chunks_per_s'] = round(stats['chunks'] / elapsed, 2) if elapsed else None
+    if rss_before is not None and rss_after is not None:
+        report['rss_before_mb'] = round(rss_before / 2**20, 2)
+        report['rss_after_mb'] = round(rss_after / 2**20, 2)
+        report['rss_growth_mb'] = round((rss_after - rss_before) / 2**20, 2)
+    return report
+
+
+def print_report(report):
+    print(f"\n== {report['endpoint']} ==")
+    for key, value in report.items():
+        if key == 'endpoint':
+            continue
+        if isinstance(value, dict):
+            value = "  ".join(f"{k}={v}" for k, v in value.items())
+        print(f"  {key:<16} {value}")
+
+
+def cmd_load(args):
+    endpoints = ['chat', 'stream'] if args.endpoint == 'both' else [args.endpoint]
+    reports = []
+
+    def run(url, pid):
+        for endpoint in endpoints:
+            rss_before = rss_bytes(pid) if pid else None
+            stats = asyncio.run(drive_sessions(url, endpoint, args.sessions, args.turns, args.timeout))
+            rss_after = rss_bytes(pid) if pid else None
+            reports.append(load_report(endpoint, stats, args.sessions, args.turns, rss_before, rss_after))
+
+    if args.url:
+        run(args.url.rstrip('/'), args.pid)
+    else:
+        with ServerProcess(args.port, fake_model_env(args)) as server:
+            run(server.url, server.pid)
+
+    return reports
+
+
+def use_fake_model(args):
+    """Point backend.py at the fake model before it is imported in-process"""
+    os.environ.update(fake_model_env(args))
+    sys.path.insert(0, str(HERE))
+
+
+async def probe_loop_lag(stop, lags, interval=0.01):
+    """Record how late a periodic timer fires; a blocked loop shows up here"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def drive_graph(graph, mode, requests):
+    """Invoke the graph `requests` times concurrently, as the /chat handler would"""
+    from langchain_core.messages import HumanMessage
+
+    async def one(index):
+        state = {'messages': [HumanMessage(content=f"Question {index}")]}
+        config = {"configurable": {"thread_id": f"{mode}-{index}"}}
+        if mode == 'blocking':
+            graph.invoke(state, config=config)
+        else:
+            await graph.ainvoke(state, config=config)
+
+    stop, lags = asyncio.Event(), []
+    probe = asyncio.create_task(probe_loop_lag(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    return {
+        'endpoint': f"graph ({mode})",
+        'requests': requests,
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_s': round(requests / elapsed, 2),
+        'loop_lag_ms': summarize(lags),
+    }
+
+
+def cmd_eventloop(args):
+    """Compare a blocking graph.invoke inside the event loop with graph.ainvoke"""
+    use_fake_model(args)
+    from langgraph.checkpoint.memory import MemorySaver
+    from langgraph.graph import StateGraph, START, END
+    import backend
+
+    def blocking_chat_node(state):
+        return {'messages': [backend.get_model().invoke(state['messages'])]}
+
+    blocking = StateGraph(backend.ChatState)
+    blocking.add_node('chat_node', blocking_chat_node)
+    blocking.add_edge(START, 'chat_node')
+    blocking.add_edge('chat_node', END)
+    blocking = blocking.compile(checkpointer=MemorySaver())
+
+    return [
+        asyncio.run(drive_graph(blocking, 'blocking', args.requests)),
+        asyncio.run(drive_graph(backend.chatbot, 'async', args.requests)),
+    ]
+
+
+def build_chat_graph(checkpointer):
+    """The backend's chat graph compiled with a specific checkpointer"""
+    from langgraph.graph import StateGraph, START, END
+    import backend
+
+    graph = StateGraph(backend.ChatState)
+    graph.add_node('chat_node', backend.chat_node)
+    graph.add_edge(START, 'chat_node')
+    graph.add_edge('chat_node', END)
+    return graph.compile(checkpointer=checkpointer)
+
+
+async def drive_turns(graph, name, sessions, turns):
+    """Concurrent sessions sending only the new message, as a checkpointed graph expects"""
+    from langchain_core.messages import HumanMessage
+
+    latencies = []
+
+    async def session(index):
+        config = {"configurable": {"thread_id": f"session-{index}"}}
+        for turn in range(turns):
+            start = time.perf_counter()
+            await graph.ainvoke({'messages': [HumanMessage(content=f"Turn {turn}")]}, config=config)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(i) for i in range(sessions)))
+    elapsed = time.perf_counter() - start
+    return {
+        'endpoint': f"checkpointer ({name})",
+        'sessions': sessions,
+        'turns': turns,
+        'elapsed_s': round(elapsed, 3),
+        'turns_per_s': round(sessions * turns / elapsed, 2),
+        'turn_latency_ms': summarize(latencies),
+    }
+
+
+def cmd_checkpointer(args):
+    """Per-turn cost of MemorySaver vs the SQLite checkpointer, plus reload after restart"""
+    import tempfile
+    use_fake_model(args)
+    from langgraph.checkpoint.memory import MemorySaver
+    from sqlite_checkpointer import SQLiteCheckpointer
+
+    reports = [asyncio.run(drive_turns(build_chat_graph(MemorySaver()), 'memory', args.sessions, args.turns))]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.sqlite3")
+        saver = SQLiteCheckpointer(path, flush_interval=args.flush_interval)
+        report = asyncio.run(drive_turns(build_chat_graph(saver), 'sqlite', args.sessions, args.turns))
+        saver.close()
+        report['flushes'] = saver.flushes
+        report['db_mb'] = round(sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp)) / 2**20, 2)
+
+        # Simulate a restart: a fresh checkpointer loads threads lazily on first access
+        start = time.perf_counter()
+        reopened = SQLiteCheckpointer(path)
+        graph = build_chat_graph(reopened)
+        report['reopen_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        loads = []
+        restored = 0
+        for index in range(args.sessions):
+            start = time.perf_counter()
+            snapshot = graph.get_state({"configurable": {"thread_id": f"session-{index}"}})
+            loads.append(time.perf_counter() - start)
+            restored += len(snapshot.values.get('messages', [])) == 2 * args.turns
+        reopened.close()
+        report['restored_sessions'] = restored
+        report['lazy_load_ms'] = summarize(loads)
+        reports.append(report)
+
+    return reports
+
+
+def legacy_chunk_frames(chunks, session_id):
+    """The original framing: a growing full_response copied per chunk and json.dumps per frame"""
+    full_response = ""
+    for content in chunks:
+        full_response += content
+        chunk_data = {'partial': True, 'chunk': content, 'full_response': full_response}
+        chunk_response = {'type': 'chunk', 'content': chunk_data['chunk'], 'session_id': session_id}
+        yield f"data: {json.dumps(chunk_response)}\n\n"
+
+
+def cpu_per_token(fn, tokens, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return round((time.process_time() - start) / (tokens * repeat) * 1e6, 3)
+
+
+def cmd_streamcpu(args):
+    """Server CPU per streamed token: frame encoding alone, then the whole /chat/stream handler"""
+    args.response_tokens = args.tokens
+    use_fake_model(args)
+    os.environ.setdefault('CHAT_RESPONSE_CACHE_SIZE', '0')
+    import main
+    from sse import chunk_encoder
+
+    session_id = str(uuid.uuid4())
+    tokens = [f" token{i}" for i in range(args.tokens)]
+    encode = chunk_encoder(session_id)
+    reports = [
+        {'endpoint': "framing (legacy)", 'tokens': args.tokens,
+         'cpu_us_per_token': cpu_per_token(lambda: list(legacy_chunk_frames(tokens, session_id)),
+                                           args.tokens, args.repeat)},
+        {'endpoint': "framing (current)", 'tokens': args.tokens,
+         'cpu_us_per_token': cpu_per_token(lambda: [encode(t) for t in tokens], args.tokens, args.repeat)},
+    ]
+
+    async def never_disconnect():
+        await asyncio.Event().wait()
+
+    async def stream_all():
+        from starlette.requests import Request
+        http_request = Request({'type': 'http', 'headers': []}, receive=never_disconnect)
+        for index in range(args.repeat):
+            request = main.ChatRequest(message=f"Question {index}")
+            response = await main.chat_stream_endpoint(request, http_request)
+            async for _ in response.body_iterator:
+                pass
+
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    asyncio.run(stream_all())
+    cpu, wall = time.process_time() - start_cpu, time.perf_counter() - start_wall
+    reports.append({
+        'endpoint': "/chat/stream handler (fake model)",
+        'tokens': args.tokens,
+        'requests': args.repeat,
+        'cpu_us_per_token': round(cpu / (args.tokens * args.repeat) * 1e6, 3),
+        'tokens_per_s': round(args.tokens * args.repeat / wall, 1),
+    })
+    return reports
+
+
+def gemini_like_history(index, turns):
+    """A history shaped like the Gemini replies the backend stores, ids included"""
+    from langchain_core.messages import AIMessage, HumanMessage
+    from fake_llm import _VOCABULARY
+
+    messages = []
+    for turn in range(turns):
+        words = [_VOCABULARY[(index * 7 + turn * 13 + i * i) % len(_VOCABULARY)] for i in range(60)]
+        messages.append(HumanMessage(content=f"Question {turn} from session {index}: how does the graph stream?",
+                                     id=str(uuid.uuid4())))
+        messages.append(AIMessage(
+            content=" ".join(words), id=f"run--{uuid.uuid4()}-0",
+            response_metadata={'finish_reason': 'STOP', 'model_name': 'gemini-2.5-flash', 'safety_ratings': []},
+            usage_metadata={'input_tokens': 40 * turn + 20, 'output_tokens': 60, 'total_tokens': 40 * turn + 80},
+        ))
+    return messages
+
+
+def cmd_memory(args):
+    """Session memory held as LangChain messages vs compact records vs compressed records"""
+    import gc
+    import tracemalloc
+    sys.path.insert(0, str(HERE))
+    from session_store import SessionStore
+
+    def measure(name, build):
+        gc.collect()
+        tracemalloc.start()
+        held = build()
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return held, {
+            'endpoint': f"memory ({name})",
+            'sessions': args.sessions,
+            'messages': args.sessions * args.turns * 2,
+            'mb': round(used / 2**20, 1),
+            'bytes_per_session': round(used / args.sessions),
+        }
+
+    def as_messages():
+        return {f"session-{i}": {'messages': gemini_like_history(i, args.turns)} for i in range(args.sessions)}
+
+    def as_records(compress):
+        store = SessionStore(max_sessions=0, max_bytes=0, ttl_seconds=0, compress_after=0)
+        for i in range(args.sessions):
+            store.put(f"session-{i}", {'messages': gemini_like_history(i, args.turns)})
+        if compress:
+            store.compress_idle(0)
+        return store
+
+    held, baseline = measure('langchain messages', as_messages)
+    del held
+    reports = [baseline]
+    for name, compress in (('compact records', False), ('compressed records', True)):
+        store, report = measure(name, lambda: as_records(compress))
+        report['estimated_mb'] = round(store.stats()['bytes'] / 2**20, 1)
+        report['vs_messages'] = f"{baseline['mb'] / report['mb']:.1f}x smaller"
+
+        # Access cost: a first get() of a compressed session unpacks it; every get() rebuilds messages
+        sample = [f"session-{i}" for i in range(0, args.sessions, max(1, args.sessions // 1000))]
+        for key in (('first_get_ms', 'get_ms') if compress else ('get_ms',)):
+            latencies = []
+            for session_id in sample:
+                start = time.perf_counter()
+                store.get(session_id)
+                latencies.append(time.perf_counter() - start)
+            report[key] = summarize(latencies)
+        reports.append(report)
+        del store
+    return reports
+
+
+def synthetic_conversation(turns, facts, seed=0):
+    """A long chat with `facts` turns that each state a code, and a question recalling each one"""
+    import random
+    from langchain_core.messages import AIMessage, HumanMessage
+    rng = random.Random(seed)
+    letters = "bcdfghjklmnprstvz"
+    vocabulary = ["".join(rng.choice(letters) + rng.choice("aeiou") for _ in range(3)) for _ in range(3000)]
+
+    def words(n):
+        return " ".join(rng.choice(vocabulary) for _ in range(n))
+
+    planted = dict(zip(rng.sample(range(turns * 4 // 5), facts), rng.sample(vocabulary, facts)))
+    messages, questions = [], []
+    for turn in range(turns):
+        if turn in planted:
+            name, code = planted[turn], rng.randrange(10_000, 99_999)
+            messages += [HumanMessage(content=f"The access code for project {name} is {code}, keep it in mind. {words(8)}"),
+                         AIMessage(content=f"Noted: project {name} uses access code {code}. {words(30)}")]
+            questions.append((len(messages) - 2, f"Remind me, which access code did project {name} use?"))
+        elif turn % 5 == 0:
+            # Distractors share the question's wording but name another project
+            messages += [HumanMessage(content=f"What did the build log for project {rng.choice(vocabulary)} say about the code? {words(8)}"),
+                         AIMessage(content=words(40))]
+        else:
+            messages += [HumanMessage(content=words(12)), AIMessage(content=words(40))]
+    return messages, questions
+
+
+def cmd_recall(args):
+    """Recall and latency of the vector memory, and prompt size, as sessions grow"""
+    sys.path.insert(0, str(HERE))
+    from langchain_core.messages import HumanMessage
+    from context_window import message_tokens
+    from vector_memory import VectorMemory
+
+    reports = []
+    for turns in args.turns:
+        messages, questions = synthetic_conversation(turns, min(args.facts, turns // 2))
+        memory = VectorMemory(top_k=args.top_k, recent_messages=args.recent_messages, dim=args.dim)
+        best = VectorMemory(top_k=1, recent_messages=args.recent_messages, dim=args.dim)
+        start = time.perf_counter()
+        memory.build_context('bench', messages + [HumanMessage(content="hello")], '', 0)
+        build_seconds = time.perf_counter() - start
+
+        hits_at_1 = hits_at_k = 0
+        latencies, prompt_tokens = [], []
+        for fact_start, question in questions:
+            history = messages + [HumanMessage(content=question)]
+            start = time.perf_counter()
+            context = memory.build_context('bench', history, '', 0)
+            latencies.append(time.perf_counter() - start)
+            prompt_tokens.append(sum(message_tokens(m) for m in context))
+            before = memory.tail_start(history)
+            hits_at_k += fact_start in [a for a, _ in memory.recall('bench', history, before)]
+            hits_at_1 += fact_start in [a for a, _ in best.recall('bench', history, before)]
+        reports.append({
+            'endpoint': f"recall ({turns} turns)",
+            'turns': turns,
+            'questions': len(questions),
+            'recall_at_1': round(hits_at_1 / len(questions), 3),
+            f'recall_at_{args.top_k}': round(hits_at_k / len(questions), 3),
+            'context_ms': summarize(latencies),
+            'index_build_ms': round(build_seconds * 1000, 1),
+            'index_bytes': memory.stats()['bytes'],
+            'prompt_tokens_full_history': sum(message_tokens(m) for m in messages),
+            'prompt_tokens_memory': round(sum(prompt_tokens) / len(prompt_tokens)),
+        })
+    return reports
+
+
+def cmd_scaling(args):
+    """Throughput of one plain worker, then of N workers behind the affinity router"""
+    env = fake_model_env(args)
+    runs = [('direct', 1, ServerProcess(args.port, env))]
+    runs += [('router', n, ClusterProcess(args.port, env, n)) for n in args.workers]
+    reports, baseline = [], None
+    for mode, workers, server in runs:
+        with server:
+            # Warm up every worker before measuring
+            asyncio.run(drive_sessions(server.url, args.endpoint, workers * 2, 1, args.timeout))
+            stats = asyncio.run(drive_sessions(server.url, args.endpoint, args.sessions, args.turns, args.timeout))
+        report = load_report(args.endpoint, stats, args.sessions, args.turns, None, None)
+        report['endpoint'] = f"{args.endpoint} {mode} x{workers}"
+        report['workers'] = workers
+        if baseline is None:
+            baseline = report['requests_per_s']
+        report['speedup'] = round(report['requests_per_s'] / baseline, 2) if baseline else None
+        reports.append(report)
+    reports.append({'endpoint': 'scaling', 'cpu_count': os.cpu_count(),
+                    'speedup_by_workers': {r['endpoint']: r['speedup'] for r in reports}})
+    return reports
+
+
+def add_fake_model_arguments(parser):
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Fake model token rate (0 = unpaced)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fake model time to first token in seconds")
+    parser.add_argument("--response-tokens", type=int, default=60, help="Fake model tokens per reply")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fake model failure probability per call")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="Fake model probability of a slow first token")
+    parser.add_argument("--tail-latency", type=float, default=2.0, help="Fake model slow first-token delay in seconds")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the spawned server")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="ChatBot API benchmarks")
+    parser.add_argument("--json", metavar="PATH", help="Also write results as JSON to PATH")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load = commands.add_parser("load", help="Concurrent sessions against /chat and /chat/stream")
+    load.add_argument("--sessions", type=int, default=20, help="Concurrent sessions")
+    load.add_argument("--turns", type=int, default=3, help="Turns per session")
+    load.add_argument("--endpoint", choices=["chat", "stream", "both"], default="both")
+    load.add_argument("--url", help="Benchmark a running server instead of spawning one")
+    load.add_argument("--pid", type=int, help="Server PID for RSS reporting when using --url")
+    load.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    add_fake_model_arguments(load)
+    load.set_defaults(func=cmd_load)
+
+    eventloop = commands.add_parser("eventloop", help="Blocking invoke vs ainvoke throughput on one event loop")
+    eventloop.add_argument("--requests", type=int, default=100, help="Concurrent graph invocations")
+    add_fake_model_arguments(eventloop)
+    eventloop.set_defaults(func=cmd_eventloop)
+
+    checkpointer = commands.add_parser("checkpointer", help="MemorySaver vs SQLite checkpointer per-turn cost")
+    checkpointer.add_argument("--sessions", type=int, default=20, help="Concurrent sessions")
+    checkpointer.add_argument("--turns", type=int, default=10, help="Turns per session")
+    checkpointer.add_argument("--flush-interval", type=float, default=0.05, help="SQLite group-commit interval")
+    add_fake_model_arguments(checkpointer)
+    checkpointer.set_defaults(func=cmd_checkpointer, tokens_per_second=0.0, latency=0.0)
+
+    streamcpu = commands.add_parser("streamcpu", help="Server CPU per streamed token")
+    streamcpu.add_argument("--tokens", type=int, default=2000, help="Tokens per streamed response")
+    streamcpu.add_argument("--repeat", type=int, default=10, help="Responses per measurement")
+    add_fake_model_arguments(streamcpu)
+    streamcpu.set_defaults(func=cmd_streamcpu, tokens_per_second=0.0, latency=0.0)
+
+    memory = commands.add_parser("memory", help="Session store memory: LangChain messages vs compact records")
+    memory.add_argument("--sessions", type=int, default=100_000, help="Sessions held in memory")
+    memory.add_argument("--turns", type=int, default=3, help="Turns (question and answer) per session")
+    memory.set_defaults(func=cmd_memory)
+
+    recall = commands.add_parser("recall", help="Vector memory recall, latency and prompt size vs session length")
+    recall.add_argument("--turns", type=int, nargs="+", default=[100, 1000, 5000], help="Session lengths in turns")
+    recall.add_argument("--facts", type=int, default=50, help="Facts planted per session and asked about later")
+    recall.add_argument("--top-k", type=int, default=4, help="Earlier turns recalled per question")
+    recall.add_argument("--recent-messages", type=int, default=12, help="Messages kept verbatim")
+    recall.add_argument("--dim", type=int, default=512, help="Embedding dimensions")
+    recall.set_defaults(func=cmd_recall)
+
+    scaling = commands.add_parser("scaling", help="Throughput with 1..N workers behind the session-affinity router")
+    scaling.add_argument("--workers", type=lambda v: [int(n) for n in v.split(",")], default=[1, 2, 4],
+                         help="Comma-separated worker counts (default: 1,2,4)")
+    scaling.add_argument("--sessions", type=int, default=64, help="Concurrent sessions")
+    scaling.add_argument("--turns", type=int, default=5, help="Turns per session")
+    scaling.add_argument("--endpoint", choices=["chat", "stream"], default="chat")
+    scaling.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    add_fake_model_arguments(scaling)
+    # Unpaced model: the server's CPU is what is being scaled
+    scaling.set_defaults(func=cmd_scaling, tokens_per_second=0.0, latency=0.0)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    reports = args.func(args)
+    for report in reports:
+        print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(reports, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Multi-process serving with session affinity.
+
+    python cluster.py --workers 4 --port 8000
+
+Starts one uvicorn process per worker, each running main:app on a private
+port, plus a small affinity router on the public port. The router sends
+every request carrying a session_id to the worker that owns it (see
+affinity.py). Each conversation's state, its per-session lock and its
+share of the response cache therefore live in a single process, and workers
+need no shared store. Requests without a session id go round-robin. The
+chosen worker then issues an id that hashes back to itself.
+
+/health and /metrics are answered by the router from all workers: health is
+"healthy" only when every worker is, and metrics gain a `worker` label.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+import httpx
+from urllib.parse import parse_qs
+
+from affinity import worker_for
+
+HERE = Path(__file__).resolve().parent
+
+# Headers that describe one connection and must not be forwarded
+HOP_BY_HOP = {
+    b"connection", b"keep-alive", b"proxy-authenticate", b"proxy-authorization",
+    b"te", b"trailer", b"transfer-encoding", b"upgrade", b"host",
+}
+
+# Paths that carry the session id as their last segment
+# (resumable stream ids are issued like session ids, so they route the same way)
+SESSION_PATH_PREFIXES = ("/chat/history/", "/chat/session/", "/chat/export/", "/chat/stream/")
+
+
+def session_from_request(path: str, body: bytes, headers=()):
+    """session_id of a request from its path, Last-Event-ID or JSON body, or None"""
+    for name, value in headers:
+        if name == b"last-event-id":
+            # "<stream_id>:<seq>": the stream lives on the worker that issued its id
+            return value.decode("latin-1").rpartition(":")[0] or None
+    for prefix in SESSION_PATH_PREFIXES:
+        if path.startswith(prefix):
+            return path[len(prefix):].split("/", 1)[0] or None
+    if body:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return None
+        if isinstance(data, dict) and isinstance(data.get("session_id"), str):
+            return data["session_id"] or None
+    return None
+
+
+def label_sample(line: str, label: str) -> str:
+    """Add `label` (e.g. worker="1") to one exposition-format sample line"""
+    name_end = min((i for i in (line.find("{"), line.find(" ")) if i >= 0), default=len(line))
+    if line[name_end:name_end + 1] == "{":
+        sep = "" if line[name_end + 1:name_end + 2] == "}" else ","
+        return f"{line[:name_end + 1]}{label}{sep}{line[name_end + 1:]}"
+    return f"{line[:name_end]}{{{label}}}{line[name_end:]}"
+
+
+def merge_metrics(texts: List[str]) -> str:
+    """Merge workers' /metrics output, keeping each metric family together"""
+    families = {}
+    for index, text in enumerate(texts):
+        family = None
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith("# "):
+                parts = line.split(" ", 3)
+                if len(parts) >= 3 and parts[1] in ("HELP", "TYPE"):
+                    family = families.setdefault(parts[2], {"meta": {}, "samples": []})
+                    family["meta"].setdefault(parts[1], line)
+                continue
+            if family is None:
+                family = families.setdefault(line.split("{", 1)[0].split(" ", 1)[0], {"meta": {}, "samples": []})
+            family["samples"].append(label_sample(line, f'worker="{index}"'))
+    lines = []
+    for family in families.values():
+        lines.extend(family["meta"][key] for key in ("HELP", "TYPE") if key in family["meta"])
+        lines.extend(family["samples"])
+    return "\n".join(lines) + "\n"
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ConnectionAbortedError()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def send_response(send, status: int, body: bytes, content_type: bytes = b"application/json"):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+class AffinityRouter:
+    """ASGI app forwarding each request to the worker owning its session"""
+
+    def __init__(self, worker_urls: List[str], timeout: float = 300.0, on_shutdown=None):
+        self.workers = [url.rstrip("/") for url in worker_urls]
+        self.timeout = timeout
+        self.on_shutdown = on_shutdown
+        self.client = None
+        self._round_robin = itertools.count()
+
+    def pick(self, session_id) -> int:
+        if session_id is None:
+            return next(self._round_robin) % len(self.workers)
+        return worker_for(session_id, len(self.workers))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] == "websocket":
+            query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+            session_id = (query.get("session_id") or [None])[0]
+            await self._forward_websocket(self.pick(session_id), scope, receive, send)
+            return
+        if scope["type"] != "http":
+            raise RuntimeError(f"Unsupported ASGI scope type '{scope['type']}'")
+
+        path = scope["path"]
+        if path == "/health":
+            await self._health(send)
+            return
+        if path == "/metrics":
+            await self._metrics(send)
+            return
+
+        try:
+            body = await read_body(receive)
+        except ConnectionAbortedError:
+            return
+        worker = self.pick(session_from_request(path, body, scope.get("headers", ())))
+        await self._forward(worker, scope, body, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.client = httpx.AsyncClient(
+                    timeout=httpx.Timeout(self.timeout, connect=5.0),
+                    limits=httpx.Limits(max_connections=None, max_keepalive_connections=512),
+                )
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.client is not None:
+                    await self.client.aclose()
+                if self.on_shutdown is not None:
+                    await asyncio.to_thread(self.on_shutdown)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _forward(self, worker: int, scope, body: bytes, receive, send):
+        target = self.workers[worker] + (scope.get("raw_path") or scope["path"].encode()).decode("latin-1")
+        if scope.get("query_string"):
+            target += "?" + scope["query_string"].decode("latin-1")
+        headers = [(k, v) for k, v in scope["headers"] if k.lower() not in HOP_BY_HOP]
+        request = self.client.build_request(scope["method"], target, headers=headers, content=body)
+        try:
+            response = await self.client.send(request, stream=True)
+        except httpx.HTTPError as e:
+            await send_response(send, 502, json.dumps({"detail": f"Worker {worker} unavailable: {e}"}).encode())
+            return
+
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [(k, v) for k, v in response.headers.raw if k.lower() not in HOP_BY_HOP],
+            })
+            # Relay until done; if the client leaves first, closing the
+            # upstream response lets the worker notice and stop generating
+            relay = asyncio.ensure_future(self._relay(response, send))
+            disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+            await asyncio.wait({relay, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            disconnect.cancel()
+            if not relay.done():
+                relay.cancel()
+            elif relay.exception() is not None and not isinstance(relay.exception(), OSError):
+                raise relay.exception()
+        finally:
+            await response.aclose()
+
+    async def _forward_websocket(self, worker: int, scope, receive, send):
+        """Bridge a client WebSocket to the same path on `worker`"""
+        from websockets.asyncio.client import connect
+        from websockets.exceptions import ConnectionClosed
+
+        if (await receive())["type"] != "websocket.connect":
+            return
+        target = self.workers[worker].replace("http", "ws", 1) + scope["path"]
+        if scope.get("query_string"):
+            target += "?" + scope["query_string"].decode("latin-1")
+        try:
+            upstream = await connect(target, max_size=None)
+        except (OSError, ConnectionClosed, TimeoutError) as e:
+            await send({"type": "websocket.close", "code": 1011, "reason": f"Worker {worker} unavailable: {e}"[:120]})
+            return
+        await send({"type": "websocket.accept"})
+
+        async def client_to_worker():
+            while True:
+                message = await receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                await upstream.send(message["text"] if message.get("text") is not None else message.get("bytes", b""))
+
+        async def worker_to_client():
+            try:
+                async for message in upstream:
+                    key = "text" if isinstance(message, str) else "bytes"
+                    await send({"type": "websocket.send", key: message})
+            except ConnectionClosed:
+                pass
+            code = upstream.close_code or 1000
+            await send({"type": "websocket.close", "code": code, "reason": upstream.close_reason or ""})
+
+        tasks = [asyncio.ensure_future(client_to_worker()), asyncio.ensure_future(worker_to_client())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Closing the worker side lets it abort a turn still in progress
+            await upstream.close()
+
+    async def _relay(self, response, send):
+        async for chunk in response.aiter_raw():
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def _gather(self, path: str):
+        async def one(url):
+            try:
+                return await self.client.get(url + path, timeout=5.0)
+            except httpx.HTTPError as e:
+                return e
+        return await asyncio.gather(*(one(url) for url in self.workers))
+
+    async def _health(self, send):
+        workers = []
+        for index, result in enumerate(await self._gather("/health")):
+            if isinstance(result, Exception) or result.status_code != 200:
+                workers.append({"worker": index, "status": "unreachable"})
+            else:
+                workers.append({"worker": index, **result.json()})
+        statuses = {w["status"] for w in workers}
+        status = "healthy" if statuses == {"healthy"} else ("starting" if "starting" in statuses else "degraded")
+        await send_response(send, 200, json.dumps({"status": status, "service": "ChatBot API", "workers": workers}).encode())
+
+    async def _metrics(self, send):
+        texts = [r.text for r in await self._gather("/metrics") if not isinstance(r, Exception) and r.status_code == 200]
+        await send_response(send, 200, merge_metrics(texts).encode(), b"text/plain; version=0.0.4; charset=utf-8")
+
+
+def start_workers(workers: int, base_port: int, log_level: str) -> List[subprocess.Popen]:
+    """One uvicorn process per worker on base_port, base_port+1, ..."""
+    processes = []
+    for index in range(workers):
+        env = {**os.environ, "CHAT_WORKER_INDEX": str(index), "CHAT_WORKER_COUNT": str(workers)}
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+             "--port", str(base_port + index), "--log-level", log_level],
+            cwd=HERE, env=env,
+        ))
+    return processes
+
+
+def wait_for_workers(urls: List[str], processes: List[subprocess.Popen], timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    pending = set(range(len(urls)))
+    while pending and time.monotonic() < deadline:
+        for index in list(pending):
+            if processes[index].poll() is not None:
+                raise RuntimeError(f"Worker {index} exited during startup")
+            try:
+                if httpx.get(f"{urls[index]}/health", timeout=1).json().get("status") == "healthy":
+                    pending.discard(index)
+            except (httpx.HTTPError, ValueError):
+                pass
+        time.sleep(0.05)
+    if pending:
+        raise RuntimeError(f"Workers {sorted(pending)} did not become ready within {timeout:.0f}s")
+
+
+def stop_workers(processes: List[subprocess.Popen]):
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def run_cluster(workers: int, host: str = "0.0.0.0", port: int = 8000, base_port: int = 0, log_level: str = "info"):
+    """Serve main:app from `workers` processes behind the affinity router"""
+    import uvicorn
+
+    base_port = base_port or port + 1
+    urls = [f"http://127.0.0.1:{base_port + i}" for i in range(workers)]
+    processes = start_workers(workers, base_port, log_level)
+    try:
+        wait_for_workers(urls, processes)
+        print(f"Routing {host}:{port} to {workers} workers on ports {base_port}-{base_port + workers - 1}")
+        # uvicorn re-raises SIGTERM/SIGINT after shutting down, so the workers
+        # are stopped from the router's lifespan rather than only below
+        router = AffinityRouter(urls, on_shutdown=lambda: stop_workers(processes))
+        uvicorn.run(router, host=host, port=port, log_level=log_level)
+    finally:
+        stop_workers(processes)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Serve the ChatBot API from several worker processes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (default: CPU count)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000, help="public port served by the router")
+    parser.add_argument("--base-port", type=int, default=0, help="first worker port (default: port + 1)")
+    parser.add_argument("--log-level", default="info")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    run_cluster(args.workers, args.host, args.port, args.base_port, args.log_level)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Compact storage for conversation history.
+
+A LangChain message is a pydantic model carrying metadata dicts (response
+and usage metadata, additional kwargs) that the ChatBot never reads back.
+The session store keeps each message as a slotted MessageRecord instead,
+holding only the role, the content and the message id. Roles are interned,
+so all records share a handful of strings. Messages are rebuilt only when
+the graph needs them, and idle histories can be packed into one
+zlib-compressed blob.
+
+Records expose the same `type`, `content` and `id` attributes as messages,
+so code that only reads a history works on either.
+"""
+
+import pickle
+import sys
+import zlib
+from typing import Iterable, List, Tuple, Union
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+MESSAGE_CLASSES = {'human': HumanMessage, 'ai': AIMessage, 'system': SystemMessage}
+ROLES = {role: sys.intern(role) for role in MESSAGE_CLASSES}
+
+# Roles as the HTTP API reports them
+API_ROLES = {'human': 'user', 'ai': 'assistant', 'system': 'system', 'tool': 'tool'}
+
+
+class MessageRecord:
+    """The parts of a chat message the ChatBot keeps"""
+
+    __slots__ = ('type', 'content', 'id')
+
+    def __init__(self, type: str, content, id=None):
+        self.type = ROLES.get(type) or sys.intern(type)
+        self.content = content
+        self.id = id
+
+    def to_message(self) -> BaseMessage:
+        return MESSAGE_CLASSES[self.type](content=self.content, id=self.id)
+
+    def __eq__(self, other):
+        return isinstance(other, MessageRecord) and \
+            (self.type, self.content, self.id) == (other.type, other.content, other.id)
+
+    def __repr__(self):
+        return f"MessageRecord({self.type!r}, {self.content!r}, id={self.id!r})"
+
+
+# Per-record cost beyond the content: the record itself, a uuid id string
+# and its slot in the history tuple
+RECORD_OVERHEAD_BYTES = sys.getsizeof(MessageRecord('ai', '')) + sys.getsizeof('0' * 36) + 8
+
+# Messages that need more than role, content and id (tool calls, names,
+# provider kwargs) are stored unchanged
+Record = Union[MessageRecord, BaseMessage]
+
+
+def is_plain(message: BaseMessage) -> bool:
+    """Whether a record keeps everything about `message` that is ever read back"""
+    return message.type in MESSAGE_CLASSES and not message.additional_kwargs and \
+        message.name is None and not getattr(message, 'tool_calls', None) and \
+        not getattr(message, 'invalid_tool_calls', None)
+
+
+def to_record(message: Record) -> Record:
+    if isinstance(message, MessageRecord) or not is_plain(message):
+        return message
+    return MessageRecord(message.type, message.content, message.id)
+
+
+def to_records(messages: Iterable[Record]) -> Tuple[Record, ...]:
+    return tuple(to_record(m) for m in messages)
+
+
+def to_message(record: Record) -> BaseMessage:
+    return record.to_message() if isinstance(record, MessageRecord) else record
+
+
+def to_messages(records: Iterable[Record]) -> List[BaseMessage]:
+    return [to_message(r) for r in records]
+
+
+def api_role(record: Record) -> str:
+    return API_ROLES.get(record.type, record.type)
+
+
+def record_bytes(record: Record) -> int:
+    """Approximate memory held by one record"""
+    if isinstance(record, MessageRecord):
+        return RECORD_OVERHEAD_BYTES + sys.getsizeof(record.content)
+    # Full messages cost about this much on top of their content
+    return 600 + sys.getsizeof(record.content)
+
+
+def pack(records: Tuple[Record, ...]) -> bytes:
+    """Serialize and compress a history"""
+    rows = [(r.type, r.content, r.id) if isinstance(r, MessageRecord) else r for r in records]
+    return zlib.compress(pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def unpack(blob: bytes) -> Tuple[Record, ...]:
+    """Inverse of pack()"""
+    rows = pickle.loads(zlib.decompress(blob))
+    return tuple(MessageRecord(*row) if isinstance(row, tuple) else row for row in rows)
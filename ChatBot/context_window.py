@@ -0,0 +1,89 @@
+"""
+Token-budgeted context window for the chatbot.
+
+Recent turns are sent to the model verbatim; older turns are folded into a
+running summary. The summary is cached in the chat state together with the
+number of messages it covers, so it is only recomputed once the unsummarized
+tail outgrows the budget.
+"""
+
+import os
+from dataclasses import dataclass
+from typing import List
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an AI assistant. "
+    "Update the existing summary with the new messages. Keep names, facts, decisions and open "
+    "questions; drop small talk. Reply with the updated summary only."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) without a tokenizer"""
+    return len(text) // 4 + 4
+
+
+def message_tokens(message: BaseMessage) -> int:
+    return estimate_tokens(str(message.content))
+
+
+@dataclass
+class ContextWindow:
+    budget_tokens: int = 8000  # 0 disables summarization
+    recent_tokens: int = 4000  # tail kept verbatim after a summary refresh
+    min_recent_messages: int = 4
+
+    @classmethod
+    def from_env(cls) -> "ContextWindow":
+        """Build the window from CHAT_CONTEXT_* environment variables"""
+        budget = int(os.getenv('CHAT_CONTEXT_TOKEN_BUDGET', '8000'))
+        return cls(
+            budget_tokens=budget,
+            recent_tokens=int(os.getenv('CHAT_CONTEXT_RECENT_TOKENS', str(budget // 2))),
+            min_recent_messages=int(os.getenv('CHAT_CONTEXT_MIN_RECENT_MESSAGES', '4')),
+        )
+
+    def context_tokens(self, messages: List[BaseMessage], summary: str, summarized: int) -> int:
+        """Estimated size of what would be sent to the model"""
+        tokens = estimate_tokens(summary) if summary else 0
+        return tokens + sum(message_tokens(m) for m in messages[summarized:])
+
+    def fold_point(self, messages: List[BaseMessage], summarized: int) -> int:
+        """Index of the first message to keep verbatim after the next summary refresh"""
+        keep_from, tokens = len(messages), 0
+        for i in range(len(messages) - 1, summarized - 1, -1):
+            tokens += message_tokens(messages[i])
+            if tokens > self.recent_tokens and len(messages) - i > self.min_recent_messages:
+                break
+            keep_from = i
+        # Never split a turn: the verbatim tail starts at a user message
+        while keep_from > summarized and messages[keep_from].type != "human":
+            keep_from -= 1
+        return keep_from
+
+    def is_stale(self, messages: List[BaseMessage], summary: str, summarized: int) -> bool:
+        """True when the context exceeds the budget and there is something to fold"""
+        if not self.budget_tokens:
+            return False
+        if self.context_tokens(messages, summary, summarized) <= self.budget_tokens:
+            return False
+        return self.fold_point(messages, summarized) > summarized
+
+    def build_context(self, messages: List[BaseMessage], summary: str, summarized: int) -> List[BaseMessage]:
+        """Messages to send to the model: the summary, then the verbatim tail"""
+        tail = messages[summarized:]
+        if not summary:
+            return list(tail)
+        return [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")] + tail
+
+    def summary_prompt(self, summary: str, folded: List[BaseMessage]) -> List[BaseMessage]:
+        """Prompt asking the model to fold `folded` into the running summary"""
+        transcript = "\n".join(
+            f"{'User' if m.type == 'human' else 'Assistant'}: {m.content}" for m in folded
+        )
+        return [
+            SystemMessage(content=SUMMARY_INSTRUCTIONS),
+            HumanMessage(content=f"Existing summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"),
+        ]
@@ -0,0 +1,152 @@
+"""
+Deterministic offline stand-in for the Gemini chat model.
+
+Used to load test the ChatBot API without calling Google. The reply is
+derived from a hash of the conversation, so the same input always streams
+the same tokens at the same pace.
+"""
+
+import asyncio
+import hashlib
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+_VOCABULARY = (
+    "graph", "node", "edge", "state", "stream", "token", "model", "session",
+    "message", "checkpoint", "workflow", "answer", "context", "latency",
+    "the", "a", "of", "and", "to", "in", "is", "for", "with", "on",
+)
+
+
+class FakeModelError(RuntimeError):
+    """Raised when failure injection is triggered"""
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """Chat model that streams a deterministic reply at a configurable rate"""
+
+    model: str = "fake-streaming"
+    temperature: float = 0.5
+    response_tokens: int = 60
+    tokens_per_second: float = 200.0  # 0 disables pacing
+    first_token_latency: float = 0.05  # seconds before the first token
+    failure_rate: float = 0.0  # probability that a call raises FakeModelError
+    tail_rate: float = 0.0  # probability that a call waits tail_latency before its first token
+    tail_latency: float = 2.0
+    seed: int = 0
+
+    _rng: random.Random = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._rng = random.Random(self.seed)
+
+    @classmethod
+    def from_env(cls) -> "FakeStreamingChatModel":
+        """Build the fake model from FAKE_LLM_* environment variables"""
+        return cls(
+            response_tokens=int(os.getenv('FAKE_LLM_RESPONSE_TOKENS', '60')),
+            tokens_per_second=float(os.getenv('FAKE_LLM_TOKENS_PER_SECOND', '200')),
+            first_token_latency=float(os.getenv('FAKE_LLM_LATENCY', '0.05')),
+            failure_rate=float(os.getenv('FAKE_LLM_FAILURE_RATE', '0')),
+            tail_rate=float(os.getenv('FAKE_LLM_TAIL_RATE', '0')),
+            tail_latency=float(os.getenv('FAKE_LLM_TAIL_LATENCY', '2')),
+            seed=int(os.getenv('FAKE_LLM_SEED', '0')),
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"model": self.model, "temperature": self.temperature}
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        """Pick reply tokens from a hash of the conversation"""
+        digest = hashlib.sha256()
+        for message in messages:
+            digest.update(message.type.encode())
+            digest.update(str(message.content).encode())
+        rng = random.Random(int.from_bytes(digest.digest()[:8], "big") ^ self.seed)
+        words = [rng.choice(_VOCABULARY) for _ in range(self.response_tokens)]
+        return [words[0]] + [f" {word}" for word in words[1:]]
+
+    def _maybe_fail(self):
+        if self.failure_rate and self._rng.random() < self.failure_rate:
+            raise FakeModelError("Injected fake model failure")
+
+    def _first_token_delay(self) -> float:
+        if self.tail_rate and self._rng.random() < self.tail_rate:
+            return self.tail_latency
+        return self.first_token_latency
+
+    @property
+    def _token_interval(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        text = "".join(chunk.message.content for chunk in self._stream(messages, stop, run_manager, **kwargs))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        parts = []
+        async for chunk in self._astream(messages, stop, run_manager, **kwargs):
+            parts.append(chunk.message.content)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(parts)))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self._first_token_delay())
+        self._maybe_fail()
+        interval = self._token_interval
+        for i, token in enumerate(self._tokens(messages)):
+            if i and interval:
+                time.sleep(interval)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self._first_token_delay())
+        self._maybe_fail()
+        interval = self._token_interval
+        for i, token in enumerate(self._tokens(messages)):
+            if i and interval:
+                await asyncio.sleep(interval)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
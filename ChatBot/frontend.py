@@ -1,6 +1,9 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import os
 from datetime import datetime
 import time
 import uuid
@@ -191,12 +194,40 @@ st.markdown("""
 
 # Backend API configuration
 API_BASE_URL = "http://localhost:8000"
+# Backend address as seen from the user's browser; when set, Export links straight to it
+PUBLIC_API_URL = os.getenv("CHAT_PUBLIC_API_URL", "").rstrip("/")
+
+# Maximum redraws per second while a streamed response is arriving
+RENDER_FPS = 20
+
+# Long conversations: messages drawn on each rerun, older messages revealed
+# per click, and the newest messages kept in session state (older ones are
+# fetched back from the backend's paginated history)
+RENDER_WINDOW = 40
+HISTORY_PAGE = 40
+MAX_LOCAL_MESSAGES = 200
+
+# HTTP client tuning: (connect, read) timeouts in seconds and health cache TTL
+CONNECT_TIMEOUT = 3.05
+HEALTH_TIMEOUT = (CONNECT_TIMEOUT, 5)
+CHAT_TIMEOUT = (CONNECT_TIMEOUT, 30)
+STREAM_TIMEOUT = (CONNECT_TIMEOUT, 60)  # read timeout applies between chunks
+SESSION_TIMEOUT = (CONNECT_TIMEOUT, 10)
+HEALTH_TTL_SECONDS = 5
+
+# Reconnects to a /chat/stream answer after a dropped connection, and the pause before each
+STREAM_RESUME_ATTEMPTS = 3
+STREAM_RESUME_BACKOFF = 0.5
 
 # Initialize session state
 if 'messages' not in st.session_state:
     st.session_state.messages = []
 if 'session_id' not in st.session_state:
     st.session_state.session_id = str(uuid.uuid4())
+if 'first_index' not in st.session_state:
+    st.session_state.first_index = 0  # History index of messages[0]
+if 'visible_count' not in st.session_state:
+    st.session_state.visible_count = RENDER_WINDOW
 if 'backend_status' not in st.session_state:
     st.session_state.backend_status = "unknown"
 if 'streaming_enabled' not in st.session_state:
@@ -206,10 +237,22 @@ if 'is_streaming' not in st.session_state:
 if 'typewriter_speed' not in st.session_state:
     st.session_state.typewriter_speed = 0.009  # Seconds between characters
 
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """Keep-alive, connection-pooled HTTP client shared by every script run in this process"""
+    session = requests.Session()
+    # Only idempotent requests are retried; chat POSTs are never replayed
+    retries = Retry(total=2, connect=2, read=0, backoff_factor=0.1, allowed_methods=frozenset({"GET", "DELETE"}))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=32, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_data(ttl=HEALTH_TTL_SECONDS, show_spinner=False)
 def check_backend_health():
-    """Check if backend is running"""
+    """Check if backend is running (cached for HEALTH_TTL_SECONDS)"""
     try:
-        response = requests.get(f"{API_BASE_URL}/health", timeout=5)
+        response = get_http_session().get(f"{API_BASE_URL}/health", timeout=HEALTH_TIMEOUT)
         if response.status_code == 200:
             return "online"
         return "error"
@@ -223,10 +266,10 @@ def send_message_to_backend(message, session_id):
             "message": message,
             "session_id": session_id
         }
-        response = requests.post(
+        response = get_http_session().post(
             f"{API_BASE_URL}/chat",
             json=payload,
-            timeout=30
+            timeout=CHAT_TIMEOUT
         )
         
         if response.status_code == 200:
@@ -237,40 +280,143 @@ def send_message_to_backend(message, session_id):
         return {"error": f"Connection error: {str(e)}"}
 
 def stream_message_from_backend(message, session_id) -> Generator[dict, None, None]:
-    """Stream message from backend API using Server-Sent Events"""
+    """Stream message from backend API using Server-Sent Events, resuming dropped connections"""
+    payload = {
+        "message": message,
+        "session_id": session_id
+    }
+    stream_id, last_event_id = None, None
+    
+    for attempt in range(STREAM_RESUME_ATTEMPTS + 1):
+        try:
+            if last_event_id is None:
+                response = get_http_session().post(
+                    f"{API_BASE_URL}/chat/stream",
+                    json=payload,
+                    stream=True,
+                    timeout=STREAM_TIMEOUT,
+                    headers={'Accept': 'text/event-stream'}
+                )
+            else:
+                # Pick up after the last event received; the answer is not generated twice
+                response = get_http_session().get(
+                    f"{API_BASE_URL}/chat/stream/{stream_id}",
+                    stream=True,
+                    timeout=STREAM_TIMEOUT,
+                    headers={'Accept': 'text/event-stream', 'Last-Event-ID': last_event_id}
+                )
+            
+            with response:
+                if response.status_code != 200:
+                    yield {"error": f"Backend error: {response.status_code}"}
+                    return
+                
+                for line in response.iter_lines(decode_unicode=True):
+                    if line.startswith('id: '):
+                        last_event_id = line[4:]
+                    elif line.startswith('data: '):
+                        try:
+                            data = json.loads(line[6:])  # Remove 'data: ' prefix
+                        except json.JSONDecodeError:
+                            continue
+                        if data.get('type') == 'session_start':
+                            stream_id = data.get('stream_id')
+                        yield data
+                return
+                        
+        except requests.exceptions.RequestException as e:
+            if stream_id is None or last_event_id is None or attempt == STREAM_RESUME_ATTEMPTS:
+                yield {"error": f"Connection error: {str(e)}"}
+                return
+            time.sleep(STREAM_RESUME_BACKOFF * (attempt + 1))
+
+@st.cache_data(ttl=600, max_entries=256, show_spinner=False)
+def fetch_history_page(session_id, cursor, limit):
+    """Fetch `limit` messages from index `cursor` of the backend history (cached: history only grows)"""
     try:
-        payload = {
-            "message": message,
-            "session_id": session_id
-        }
-        
-        with requests.post(
-            f"{API_BASE_URL}/chat/stream",
-            json=payload,
+        response = get_http_session().get(
+            f"{API_BASE_URL}/chat/history/{session_id}",
+            params={"cursor": cursor, "limit": limit},
+            timeout=SESSION_TIMEOUT
+        )
+        if response.status_code == 200:
+            return [{'role': m['role'], 'content': m['content']} for m in response.json().get('messages', [])]
+    except requests.exceptions.RequestException:
+        pass
+    return None
+
+def show_earlier_messages():
+    """Reveal another page of older messages, fetching them from the backend if they were trimmed"""
+    state = st.session_state
+    state.visible_count += HISTORY_PAGE
+    missing = state.visible_count - len(state.messages)
+    if missing > 0 and state.first_index > 0:
+        cursor = max(0, state.first_index - missing)
+        page = fetch_history_page(state.session_id, cursor, state.first_index - cursor)
+        if page is None:
+            state.visible_count -= HISTORY_PAGE
+            st.toast("Could not load earlier messages")
+            return
+        state.messages = page + state.messages
+        state.first_index = cursor
+
+def fetch_export(session_id):
+    """Read the backend's NDJSON export in chunks; None if it could not be fetched"""
+    try:
+        with get_http_session().get(
+            f"{API_BASE_URL}/chat/export/{session_id}",
             stream=True,
-            timeout=60,
-            headers={'Accept': 'text/event-stream'}
+            timeout=SESSION_TIMEOUT
         ) as response:
-            
             if response.status_code != 200:
-                yield {"error": f"Backend error: {response.status_code}"}
-                return
-            
-            for line in response.iter_lines(decode_unicode=True):
-                if line.startswith('data: '):
-                    try:
-                        data = json.loads(line[6:])  # Remove 'data: ' prefix
-                        yield data
-                    except json.JSONDecodeError:
-                        continue
-                        
-    except requests.exceptions.RequestException as e:
-        yield {"error": f"Connection error: {str(e)}"}
+                return None
+            return b"".join(response.iter_content(chunk_size=65536))
+    except requests.exceptions.RequestException:
+        return None
+
+def reload_recent_messages():
+    """Replace the local messages with the newest backend history, which may hold part of a failed turn"""
+    state = st.session_state
+    # Pages cached while the local list was out of step may be wrong too
+    fetch_history_page.clear()
+    try:
+        response = get_http_session().get(
+            f"{API_BASE_URL}/chat/history/{state.session_id}",
+            params={"cursor": 0, "limit": 1},
+            timeout=SESSION_TIMEOUT
+        )
+        total = response.json().get('total', 0) if response.status_code == 200 else None
+    except requests.exceptions.RequestException:
+        total = None
+    if total is None:
+        st.toast("Could not reload the conversation")
+        return
+    cursor = max(0, total - min(max(RENDER_WINDOW, state.visible_count), MAX_LOCAL_MESSAGES))
+    page = fetch_history_page(state.session_id, cursor, total - cursor) if total > cursor else []
+    if page is None:
+        st.toast("Could not reload the conversation")
+        return
+    state.messages = page
+    state.first_index = cursor
+
+def trim_local_messages():
+    """Forget the oldest messages beyond what is shown; they stay available from the backend"""
+    drop = len(st.session_state.messages) - max(MAX_LOCAL_MESSAGES, st.session_state.visible_count)
+    if drop > 0:
+        del st.session_state.messages[:drop]
+        st.session_state.first_index += drop
+
+def reset_conversation():
+    st.session_state.messages = []
+    st.session_state.first_index = 0
+    st.session_state.visible_count = RENDER_WINDOW
+    st.session_state.is_streaming = False
+    st.session_state.pop('export', None)
 
 def clear_chat_session(session_id):
     """Clear chat session on backend"""
     try:
-        response = requests.delete(f"{API_BASE_URL}/chat/session/{session_id}", timeout=10)
+        response = get_http_session().delete(f"{API_BASE_URL}/chat/session/{session_id}", timeout=SESSION_TIMEOUT)
         return response.status_code == 200
     except requests.exceptions.RequestException:
         return False
@@ -310,15 +456,15 @@ col1, col2, col3, col4, col5 = st.columns(5)
 with col1:
     if st.button("🔄 New Chat", use_container_width=True):
         st.session_state.session_id = str(uuid.uuid4())
-        st.session_state.messages = []
-        st.session_state.is_streaming = False
+        reset_conversation()
         st.rerun()
 
 with col2:
     if st.button("🗑️ Clear", use_container_width=True):
         if clear_chat_session(st.session_state.session_id):
-            st.session_state.messages = []
-            st.session_state.is_streaming = False
+            reset_conversation()
+            # The session id is reused, so cached pages of the old history are stale
+            fetch_history_page.clear()
             st.rerun()
 
 with col3:
@@ -329,24 +475,37 @@ with col3:
 
 with col4:
     if st.button("📊 Status", use_container_width=True):
+        check_backend_health.clear()
         st.session_state.backend_status = check_backend_health()
         st.rerun()
 
 with col5:
-    if st.session_state.messages:
-        chat_export = {
-            "session_id": st.session_state.session_id,
-            "timestamp": datetime.now().isoformat(),
-            "messages": st.session_state.messages,
-            "streaming_enabled": st.session_state.streaming_enabled
-        }
-        st.download_button(
-            label="💾 Export",
-            data=json.dumps(chat_export, indent=2),
-            file_name=f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-            mime="application/json",
+    if st.session_state.messages and PUBLIC_API_URL:
+        # The browser downloads the NDJSON stream from the backend directly
+        st.link_button(
+            "💾 Export",
+            f"{PUBLIC_API_URL}/chat/export/{st.session_state.session_id}",
             use_container_width=True
         )
+    elif st.session_state.messages:
+        # Fetched only on request, so reruns never pull the whole history
+        export_key = (st.session_state.session_id, st.session_state.first_index + len(st.session_state.messages))
+        export = st.session_state.get('export')
+        if export is not None and export[0] == export_key:
+            st.download_button(
+                label="💾 Download",
+                data=export[1],
+                file_name=f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson",
+                mime="application/x-ndjson",
+                use_container_width=True
+            )
+        elif st.button("💾 Export", use_container_width=True):
+            data = fetch_export(st.session_state.session_id)
+            if data is None:
+                st.toast("Could not export the conversation")
+            else:
+                st.session_state.export = (export_key, data)
+                st.rerun()
 
 # Chat display area
 if not st.session_state.messages:
@@ -358,8 +517,11 @@ if not st.session_state.messages:
     </div>
     """, unsafe_allow_html=True)
 else:
-    # Display chat messages
-    for message in st.session_state.messages:
+    # Draw only the newest messages so a rerun costs the same however long the conversation gets
+    hidden = st.session_state.first_index + len(st.session_state.messages) - st.session_state.visible_count
+    if hidden > 0:
+        st.button(f"⬆️ Show earlier messages ({hidden} more)", on_click=show_earlier_messages, use_container_width=True)
+    for message in st.session_state.messages[-st.session_state.visible_count:]:
         if message['role'] == 'user':
             with st.chat_message("user"):
                 st.write(message['content'])
@@ -393,7 +555,7 @@ if user_input and not st.session_state.is_streaming:
     # Create placeholder for assistant response
     with st.chat_message("assistant"):
         if st.session_state.streaming_enabled:
-            # Streaming mode with typewriter effect
+            # Streaming mode: render chunks as they arrive
             response_placeholder = st.empty()
             status_placeholder = st.empty()
             
@@ -401,51 +563,45 @@ if user_input and not st.session_state.is_streaming:
             status_placeholder.markdown('<div class="typing-indicator">AI is thinking...</div>', unsafe_allow_html=True)
             
             full_response = ""
-            displayed_text = ""
             error_occurred = False
             
             try:
-                # Collect all chunks first
-                all_chunks = []
+                parts = []
+                last_render = 0.0
                 for chunk_data in stream_message_from_backend(user_input, st.session_state.session_id):
                     if chunk_data.get('type') == 'chunk':
-                        all_chunks.append(chunk_data.get('content', ''))
+                        if not parts:
+                            # First chunk: replace the typing indicator right away
+                            status_placeholder.empty()
+                        parts.append(chunk_data.get('content', ''))
+                        
+                        # Redraw at most RENDER_FPS times per second, however fast chunks arrive
+                        now = time.monotonic()
+                        if now - last_render >= 1.0 / RENDER_FPS:
+                            response_placeholder.markdown(
+                                f'<div class="typewriter-text">{"".join(parts)}<span class="typewriter-cursor"></span></div>',
+                                unsafe_allow_html=True
+                            )
+                            last_render = now
                     elif chunk_data.get('type') == 'complete':
-                        full_response = chunk_data.get('full_response', ''.join(all_chunks))
+                        full_response = chunk_data.get('full_response', ''.join(parts))
                         break
                     elif chunk_data.get('type') == 'error':
                         error_occurred = True
                         st.error(f"Error: {chunk_data.get('error', 'Unknown error')}")
                         break
+                else:
+                    # Stream ended without a completion event: keep what arrived
+                    full_response = ''.join(parts)
+                
+                status_placeholder.empty()
                 
                 if not error_occurred and full_response:
-                    # Clear typing indicator
-                    status_placeholder.empty()
-                    
-                    # Display typewriter effect
-                    status_placeholder.markdown('<div class="typewriter-status">Typing response...</div>', unsafe_allow_html=True)
-                    
-                    # Typewriter effect - display character by character
-                    for i in range(len(full_response) + 1):
-                        displayed_text = full_response[:i]
-                        if i < len(full_response):
-                            # Show cursor while typing
-                            response_placeholder.markdown(
-                                f'<div class="typewriter-text">{displayed_text}<span class="typewriter-cursor"></span></div>',
-                                unsafe_allow_html=True
-                            )
-                        else:
-                            # Final display without cursor
-                            response_placeholder.markdown(
-                                f'<div class="typewriter-text">{displayed_text}</div>',
-                                unsafe_allow_html=True
-                            )
-                        
-                        # Delay between characters
-                        time.sleep(st.session_state.typewriter_speed)
-                    
-                    # Remove status
-                    status_placeholder.empty()
+                    # Final display without cursor
+                    response_placeholder.markdown(
+                        f'<div class="typewriter-text">{full_response}</div>',
+                        unsafe_allow_html=True
+                    )
                     
                     # Add bot response to chat history
                     bot_message = {
@@ -455,15 +611,14 @@ if user_input and not st.session_state.is_streaming:
                     }
                     st.session_state.messages.append(bot_message)
                 else:
-                    # Remove user message if there was an error
+                    # The backend may have saved the turn before failing; show what it kept
                     if error_occurred:
-                        st.session_state.messages.pop()
+                        reload_recent_messages()
                     
             except Exception as e:
                 st.error(f"Streaming error: {str(e)}")
                 status_placeholder.empty()
-                # Remove user message on error
-                st.session_state.messages.pop()
+                reload_recent_messages()
         
         else:
             # Standard mode (non-streaming) with typewriter effect
@@ -473,8 +628,7 @@ if user_input and not st.session_state.is_streaming:
             # Handle response
             if "error" in response:
                 st.error(f"Error: {response['error']}")
-                # Remove the user message if there was an error
-                st.session_state.messages.pop()
+                reload_recent_messages()
             else:
                 # Add bot response to chat
                 bot_message = {
@@ -504,6 +658,7 @@ if user_input and not st.session_state.is_streaming:
     
     # Reset streaming state
     st.session_state.is_streaming = False
+    trim_local_messages()
     
     # Rerun to update the interface
     st.rerun()
@@ -514,7 +669,7 @@ st.markdown("---")
 st.markdown(
     f"<div style='text-align: center; color: #888; font-size: 0.8rem;'>"
     f"Session: {st.session_state.session_id[:8]}... | "
-    f"Messages: {len(st.session_state.messages)} | "
+    f"Messages: {st.session_state.first_index + len(st.session_state.messages)} | "
     f"Mode: {streaming_mode}"
     f"</div>", 
     unsafe_allow_html=True
@@ -0,0 +1,498 @@
+"""
+Per-node timing for LangGraph StateGraph workflows.
+
+`GraphTracer` is a LangChain callback handler, so it attaches to any compiled
+graph without touching node code:
+
+    tracer = GraphTracer(export_dir="traces")
+    app = instrument(graph.compile(), tracer)
+    app.invoke(state)
+    print(tracer.critical_path())
+
+Every graph run becomes a trace. Each node attempt is one span, carrying its
+superstep, wall time, time spent in model calls, approximate input/output
+state size and attempt number, so retried nodes and parallel branches
+(nodes sharing a superstep) are visible. Completed traces are kept in memory
+and, with `export_dir`, handed to a background thread that appends them as
+OTLP/JSON lines to a size-capped, rotating `traces.ndjson`. Run this module
+on an exported file to print the per-node table and the critical path.
+"""
+
+import argparse
+import atexit
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+
+# Bound on how deep/wide state is walked when estimating its size
+SIZE_MAX_DEPTH = 6
+
+
+def estimate_size(value: Any, depth: int = 0) -> int:
+    """Approximate serialized size of a state value in bytes"""
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, BaseMessage):
+        return estimate_size(value.content, depth + 1) + 16
+    if depth >= SIZE_MAX_DEPTH:
+        return 8
+    if isinstance(value, dict):
+        return sum(len(str(k)) + estimate_size(v, depth + 1) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sum(estimate_size(v, depth + 1) for v in value)
+    if hasattr(value, "model_dump"):
+        return estimate_size(value.model_dump(), depth + 1)
+    return 8
+
+
+@dataclass
+class Span:
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    kind: str  # "graph", "node" or "model"
+    start_ns: int
+    end_ns: int = 0
+    status: str = "ok"
+    error: str = ""
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration_seconds(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def to_dict(self) -> dict:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_seconds': self.duration_seconds,
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Span":
+        return cls(**{k: v for k, v in data.items() if k != 'duration_seconds'})
+
+
+def span_id(run_id: UUID) -> str:
+    return run_id.hex[:16]
+
+
+def otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def to_otlp(spans: List[Span], service_name: str = "langgraph") -> dict:
+    """OTLP/JSON (ExportTraceServiceRequest) document for `spans`"""
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': otlp_value(service_name)}]},
+        'scopeSpans': [{
+            'scope': {'name': 'graph_tracing'},
+            'spans': [{
+                'traceId': s.trace_id,
+                'spanId': s.span_id,
+                **({'parentSpanId': s.parent_id} if s.parent_id else {}),
+                'name': s.name,
+                'kind': 1,  # SPAN_KIND_INTERNAL
+                'startTimeUnixNano': str(s.start_ns),
+                'endTimeUnixNano': str(s.end_ns),
+                'attributes': [{'key': k, 'value': otlp_value(v)}
+                               for k, v in {'span.kind': s.kind, **s.attributes}.items()],
+                'status': {'code': 2, 'message': s.error} if s.status == "error" else {'code': 1},
+            } for s in spans],
+        }],
+    }]}
+
+
+def from_otlp(document: dict) -> List[Span]:
+    """Spans from a document written by `to_otlp`"""
+    spans = []
+    for resource in document.get('resourceSpans', []):
+        for scope in resource.get('scopeSpans', []):
+            for s in scope.get('spans', []):
+                attributes = {a['key']: next(iter(a['value'].values())) for a in s.get('attributes', [])}
+                for key in ('step', 'attempt', 'input_bytes', 'output_bytes', 'model_calls', 'retries'):
+                    if key in attributes:
+                        attributes[key] = int(attributes[key])
+                kind = attributes.pop('span.kind', 'node')
+                status = s.get('status', {})
+                spans.append(Span(
+                    trace_id=s['traceId'], span_id=s['spanId'], parent_id=s.get('parentSpanId'),
+                    name=s['name'], kind=kind,
+                    start_ns=int(s['startTimeUnixNano']), end_ns=int(s['endTimeUnixNano']),
+                    status="error" if status.get('code') == 2 else "ok", error=status.get('message', ''),
+                    attributes=attributes,
+                ))
+    return spans
+
+
+def node_stats(spans: List[Span]) -> List[dict]:
+    """Per-node totals for one trace, slowest first"""
+    stats: Dict[str, dict] = {}
+    for s in spans:
+        if s.kind != "node":
+            continue
+        row = stats.setdefault(s.name, {
+            'node': s.name, 'calls': 0, 'attempts': 0, 'errors': 0, 'wall_seconds': 0.0,
+            'model_seconds': 0.0, 'model_calls': 0, 'input_bytes': 0, 'output_bytes': 0,
+        })
+        row['attempts'] += 1
+        row['calls'] += s.attributes.get('attempt', 1) == 1
+        row['errors'] += s.status == "error"
+        row['wall_seconds'] += s.duration_seconds
+        row['model_seconds'] += s.attributes.get('model_seconds', 0.0)
+        row['model_calls'] += s.attributes.get('model_calls', 0)
+        row['input_bytes'] = max(row['input_bytes'], s.attributes.get('input_bytes', 0))
+        row['output_bytes'] = max(row['output_bytes'], s.attributes.get('output_bytes', 0))
+    for row in stats.values():
+        row['retries'] = row['attempts'] - row['calls']
+    return sorted(stats.values(), key=lambda r: r['wall_seconds'], reverse=True)
+
+
+def critical_path(spans: List[Span]) -> dict:
+    """Longest chain through the graph's supersteps for one trace
+
+    Supersteps run one after another and the nodes inside a step run in
+    parallel, so the critical path is the slowest branch of every step.
+    Retried attempts of a node count towards that node's branch.
+    """
+    roots = {s.span_id for s in spans if s.kind == "graph"}
+    branches: Dict[int, Dict[str, List[Span]]] = defaultdict(lambda: defaultdict(list))
+    for s in spans:
+        # Steps of nested subgraphs are counted inside their parent node
+        if s.kind == "node" and s.parent_id in roots:
+            branches[s.attributes.get('step', 0)][s.attributes.get('task', s.name)].append(s)
+
+    path, total = [], 0.0
+    for step in sorted(branches):
+        candidates = []
+        for attempts in branches[step].values():
+            start = min(a.start_ns for a in attempts)
+            end = max(a.end_ns for a in attempts)
+            candidates.append(((end - start) / 1e9, attempts[0].name, len(attempts)))
+        seconds, node, attempts = max(candidates)
+        path.append({'step': step, 'node': node, 'seconds': seconds, 'attempts': attempts,
+                     'parallel_branches': len(candidates)})
+        total += seconds
+    return {'steps': path, 'seconds': total}
+
+
+class TraceWriter:
+    """Background thread appending finished traces to a rotating NDJSON file"""
+
+    def __init__(self, directory: str, service_name: str = "langgraph", max_bytes: int = 64 * 1024 * 1024,
+                 max_files: int = 5, max_queue: int = 1000):
+        self.path = os.path.join(directory, "traces.ndjson")
+        self.service_name = service_name
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_queue = max_queue
+        self.written = 0
+        self.dropped = 0
+        os.makedirs(directory, exist_ok=True)
+        self._queue: "deque[List[Span]]" = deque()
+        self._writing = False
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, trace: List[Span]):
+        """Queue a finished trace; dropped when the writer is this far behind"""
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                return
+            self._queue.append(trace)
+            self._cond.notify()
+
+    def flush(self):
+        """Wait until every queued trace is on disk"""
+        with self._cond:
+            self._cond.wait_for(lambda: not self._queue and not self._writing)
+
+    def close(self):
+        """Write what is queued and stop the thread"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or self._queue)
+                if not self._queue:
+                    return
+                batch, self._queue = list(self._queue), deque()
+                self._writing = True
+            try:
+                lines = "".join(json.dumps(to_otlp(trace, self.service_name)) + "\n" for trace in batch)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+                    size = f.tell()
+                self.written += len(batch)
+                if self.max_bytes and size >= self.max_bytes:
+                    self._rotate()
+            except OSError:
+                self.dropped += len(batch)
+            finally:
+                with self._cond:
+                    self._writing = False
+                    self._cond.notify_all()
+
+    def _rotate(self):
+        # traces.ndjson -> .1 -> .2 ...; the oldest beyond max_files is removed
+        for n in range(max(self.max_files - 1, 0), 0, -1):
+            source = self.path if n == 1 else f"{self.path}.{n - 1}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{n}")
+        if self.max_files <= 1 and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class GraphTracer(BaseCallbackHandler):
+    """Callback handler recording graph, node and model-call spans"""
+
+    # Callbacks run on the calling thread/loop; they only do dict updates
+    run_inline = True
+
+    def __init__(self, export_dir: Optional[str] = None, max_traces: int = 100, service_name: str = "langgraph",
+                 max_file_bytes: int = 64 * 1024 * 1024, max_files: int = 5):
+        self.export_dir = export_dir
+        self.service_name = service_name
+        self.writer = TraceWriter(export_dir, service_name, max_file_bytes, max_files) if export_dir else None
+        self.completed: "deque[List[Span]]" = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+        self._open: Dict[UUID, Span] = {}
+        self._owner: Dict[UUID, Optional[Span]] = {}  # any run -> node span it runs under
+        self._traces: Dict[str, List[Span]] = {}
+        self._attempts: Dict[str, int] = {}
+
+    @classmethod
+    def from_env(cls) -> Optional["GraphTracer"]:
+        """Tracer exporting to CHAT_TRACE_DIR, or None when tracing is off"""
+        export_dir = os.getenv('CHAT_TRACE_DIR')
+        if not export_dir:
+            return None
+        return cls(
+            export_dir=export_dir,
+            max_traces=int(os.getenv('CHAT_TRACE_KEEP', '100')),
+            max_file_bytes=int(os.getenv('CHAT_TRACE_MAX_BYTES', str(64 * 1024 * 1024))),
+            max_files=int(os.getenv('CHAT_TRACE_FILES', '5')),
+        )
+
+    # LangChain callbacks
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        metadata = metadata or {}
+        name = kwargs.get('name') or (serialized or {}).get('name', 'chain')
+        with self._lock:
+            parent = self._open.get(parent_run_id) if parent_run_id else None
+            if parent is None:
+                # Outermost run we have seen: the graph itself
+                trace_id = run_id.hex
+                span = Span(trace_id, span_id(run_id), None, name, "graph", time.time_ns())
+                self._traces[trace_id] = [span]
+                self._open[run_id] = span
+                self._owner[run_id] = None
+                return
+            owner = self._owner[parent_run_id]
+            trace_id = parent.trace_id
+            node = metadata.get('langgraph_node')
+            if node is not None and name == node:
+                task = metadata.get('langgraph_checkpoint_ns', f"{node}:{run_id}")
+                attempt = self._attempts[task] = self._attempts.get(task, 0) + 1
+                span = Span(trace_id, span_id(run_id), self._parent_span(parent, owner).span_id,
+                            node, "node", time.time_ns(), attributes={
+                                'step': metadata.get('langgraph_step', 0),
+                                'task': task,
+                                'attempt': attempt,
+                                'input_bytes': estimate_size(inputs),
+                                'model_seconds': 0.0,
+                                'model_calls': 0,
+                                'retries': 0,
+                            })
+                self._traces[trace_id].append(span)
+                self._open[run_id] = span
+                self._owner[run_id] = span
+            else:
+                # Plumbing inside a node (prompts, parsers, subchains): attribute to the node
+                self._owner[run_id] = owner
+                self._open[run_id] = Span(trace_id, span_id(run_id), None, name, "internal", 0)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id, outputs=outputs)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._start_model(run_id, parent_run_id, kwargs.get('name') or (serialized or {}).get('name', 'model'))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start_model(run_id, parent_run_id, kwargs.get('name') or (serialized or {}).get('name', 'llm'))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        # Retries inside a node (e.g. Runnable.with_retry)
+        with self._lock:
+            owner = self._owner.get(run_id)
+            if owner is not None:
+                owner.attributes['retries'] += 1
+
+    # Results
+
+    def traces(self) -> List[List[Span]]:
+        """Completed traces, oldest first"""
+        with self._lock:
+            return list(self.completed)
+
+    def last_trace(self) -> List[Span]:
+        traces = self.traces()
+        return traces[-1] if traces else []
+
+    def node_stats(self, spans: Optional[List[Span]] = None) -> List[dict]:
+        return node_stats(self.last_trace() if spans is None else spans)
+
+    def critical_path(self, spans: Optional[List[Span]] = None) -> dict:
+        return critical_path(self.last_trace() if spans is None else spans)
+
+    def flush(self):
+        """Wait until every completed trace has been written to `export_dir`"""
+        if self.writer is not None:
+            self.writer.flush()
+
+    def export_otlp(self, path: str, traces: Optional[List[List[Span]]] = None) -> str:
+        """Write completed traces as one OTLP/JSON file"""
+        spans = [s for trace in (self.traces() if traces is None else traces) for s in trace]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(to_otlp(spans, self.service_name), f)
+        return path
+
+    def export_json(self, path: str, traces: Optional[List[List[Span]]] = None) -> str:
+        """Write completed traces as plain span dicts plus their summaries"""
+        traces = self.traces() if traces is None else traces
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump([{
+                'trace_id': trace[0].trace_id,
+                'spans': [s.to_dict() for s in trace],
+                'nodes': node_stats(trace),
+                'critical_path': critical_path(trace),
+            } for trace in traces if trace], f, indent=2)
+        return path
+
+    # Internals
+
+    def _parent_span(self, parent: Span, owner: Optional[Span]) -> Span:
+        # Internal runs are not exported: hang children off the enclosing node or graph
+        if parent.kind != "internal":
+            return parent
+        return owner if owner is not None else self._traces[parent.trace_id][0]
+
+    def _start_model(self, run_id: UUID, parent_run_id: Optional[UUID], name: str):
+        with self._lock:
+            parent = self._open.get(parent_run_id) if parent_run_id else None
+            if parent is None:
+                return  # Model called outside any traced graph
+            owner = self._owner[parent_run_id]
+            span = Span(parent.trace_id, span_id(run_id), self._parent_span(parent, owner).span_id,
+                        name, "model", time.time_ns())
+            self._traces[parent.trace_id].append(span)
+            self._open[run_id] = span
+            self._owner[run_id] = owner
+
+    def _end(self, run_id: UUID, outputs=None, error: Optional[BaseException] = None):
+        finished = None
+        with self._lock:
+            span = self._open.pop(run_id, None)
+            owner = self._owner.pop(run_id, None)
+            if span is None or span.kind == "internal":
+                return
+            span.end_ns = time.time_ns()
+            if error is not None:
+                span.status = "error"
+                span.error = f"{type(error).__name__}: {error}"
+            if span.kind in ("node", "graph") and outputs is not None:
+                span.attributes['output_bytes'] = estimate_size(outputs)
+            if span.kind == "model" and owner is not None:
+                owner.attributes['model_seconds'] += span.duration_seconds
+                owner.attributes['model_calls'] += 1
+            elif span.kind == "graph":
+                finished = self._traces.pop(span.trace_id, [])
+                for s in finished:
+                    self._attempts.pop(s.attributes.get('task'), None)
+                self.completed.append(finished)
+        if finished and self.writer is not None:
+            # Serialization and disk I/O happen on the writer thread, not in the callback
+            self.writer.submit(finished)
+
+
+def instrument(graph, tracer: GraphTracer):
+    """Return `graph` with `tracer` attached to every invocation"""
+    return graph.with_config(callbacks=[tracer])
+
+
+def print_report(spans: List[Span]):
+    rows = node_stats(spans)
+    print(f"{'node':<24}{'calls':>7}{'retries':>9}{'errors':>8}{'wall s':>10}{'model s':>10}{'in B':>10}{'out B':>10}")
+    for r in rows:
+        print(f"{r['node']:<24}{r['calls']:>7}{r['retries']:>9}{r['errors']:>8}{r['wall_seconds']:>10.3f}"
+              f"{r['model_seconds']:>10.3f}{r['input_bytes']:>10}{r['output_bytes']:>10}")
+    path = critical_path(spans)
+    print(f"\ncritical path: {path['seconds']:.3f}s")
+    for step in path['steps']:
+        print(f"  step {step['step']}: {step['node']} {step['seconds']:.3f}s"
+              f" ({step['parallel_branches']} parallel, {step['attempts']} attempt(s))")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize OTLP/JSON trace files written by GraphTracer")
+    parser.add_argument("files", nargs="+", help="trace files (traces.ndjson or export_otlp output)")
+    args = parser.parse_args()
+    for path in args.files:
+        by_trace = defaultdict(list)
+        with open(path, encoding="utf-8") as f:
+            # One OTLP/JSON document per line
+            for line in f:
+                if line.strip():
+                    for s in from_otlp(json.loads(line)):
+                        by_trace[s.trace_id].append(s)
+        for trace_id, trace in by_trace.items():
+            print(f"== {path} trace {trace_id}")
+            print_report(trace)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,56 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
-import uuid
-import json
 import asyncio
+import logging
+import os
+import time
+import psutil
+from contextlib import asynccontextmanager
 from langchain_core.messages import HumanMessage, AIMessage
-from backend import chatbot, ChatState, stream_chat_response
-import uvicorn
+from backend import chatbot, get_model, model_loaded, MODEL_PROVIDER, ChatState, stream_chat_response, session_store, response_cache, inflight_requests, load_session, load_history, prepare_context, save_turn, delete_history, thread_config
+from sse import dumps, encode_event, chunk_encoder
+from compact_messages import api_role
+from admission import AdmissionController, Overloaded
+from resilience import UpstreamTimeout, UpstreamUnavailable
+from affinity import new_session_id
+from websocket_chat import ChatConnection, WebSocketSettings
+from stream_buffer import StreamBuffer, StreamGone, StreamRegistry, parse_event_id
+from profiling import ProfilingMiddleware, RequestProfiler
+import metrics
+import backend
 
-app = FastAPI(title="ChatBot API", version="1.0.0")
+# Measured from process start, so interpreter startup and every import count
+IMPORT_SECONDS = time.time() - psutil.Process().create_time()
+IMPORTED = time.perf_counter()
+logger = logging.getLogger("uvicorn.error")
+
+# Startup timings and readiness reported by /health
+startup = {"ready": False, "import_seconds": IMPORT_SECONDS, "ready_seconds": None}
+
+# Build the model in the background after startup instead of on import, so
+# the server is ready quickly and the first request rarely waits for it
+WARM_MODEL = os.getenv('CHAT_WARM_MODEL', '1') != '0'
+
+async def warm_model():
+    try:
+        await asyncio.to_thread(get_model)
+        logger.info("Model '%s' loaded in %.3fs", MODEL_PROVIDER, backend.model_load_seconds)
+    except Exception as e:
+        logger.error("Could not load model '%s': %s", MODEL_PROVIDER, e)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARM_MODEL:
+        run_in_background(warm_model())
+    startup["ready"] = True
+    startup["ready_seconds"] = IMPORT_SECONDS + time.perf_counter() - IMPORTED
+    logger.info("ChatBot API ready in %.3fs (imports %.3fs)", startup["ready_seconds"], IMPORT_SECONDS)
+    yield
+
+app = FastAPI(title="ChatBot API", version="1.0.0", lifespan=lifespan)
 
 # Enable CORS for frontend integration
 app.add_middleware(
@@ -21,6 +61,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-endpoint request latency for /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Optional sampling profiles of selected requests, written to CHAT_PROFILE_DIR;
+# not installed at all unless configured
+profiler = RequestProfiler.from_env()
+if profiler is not None:
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
 class ChatMessage(BaseModel):
     content: str
     role: str
@@ -35,32 +84,92 @@ class ChatResponse(BaseModel):
     session_id: str
     status: str
 
-# In-memory session storage (in production, use Redis or database)
-active_sessions = {}
+# Global model concurrency limit with a bounded queue; also serializes
+# turns per session
+admission = AdmissionController.from_env()
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Server is busy, retry later", "reason": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable_handler(request: Request, exc: UpstreamUnavailable):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# Gauges read from the components when /metrics is scraped
+metrics.registry.gauge("chat_sessions_active", "Sessions held in the session store", lambda: len(session_store))
+metrics.registry.gauge("chat_session_store_bytes", "Approximate memory held by the session store", lambda: session_store.stats()["bytes"])
+metrics.registry.gauge("chat_response_cache_bytes", "Approximate memory held by the response cache", lambda: response_cache.stats()["bytes"])
+metrics.registry.gauge("chat_streams_active", "Turns streaming over /chat/stream or /chat/ws", lambda: stream_stats["active"])
+metrics.registry.gauge("chat_streams_detached", "Streams still generating with no client attached (CHAT_STREAM_RESUME_GRACE)",
+                       lambda: streams.detached)
+metrics.registry.gauge("chat_websockets_active", "Open /chat/ws connections", lambda: websocket_stats["active"])
+metrics.registry.gauge("chat_admission_active", "Turns holding a model slot", lambda: admission.active)
+metrics.registry.gauge("chat_circuit_breaker_state", "Model circuit breaker: 0 closed, 1 half-open, 2 open",
+                       lambda: ("closed", "half_open", "open").index(backend.upstream.breaker.state))
+metrics.registry.gauge("chat_memory_index_bytes", "Memory held by the per-session vector indexes (CHAT_MEMORY=vector)",
+                       lambda: backend.long_term_memory.stats()["bytes"] if backend.long_term_memory is not None else 0)
+metrics.registry.gauge("chat_admission_queued", "Requests waiting for a model slot or their session", lambda: admission.waiting)
+
+# Streams that ended because the client went away, and background tasks
+# (e.g. saving a partial answer) that must outlive their request
+stream_stats = {"active": 0, "completed": 0, "aborted": 0}
+websocket_stats = {"active": 0, "turns": 0, "closed_idle": 0, "closed_slow": 0}
+websocket_settings = WebSocketSettings.from_env()
+# Buffered /chat/stream turns, so dropped clients can resume with Last-Event-ID
+streams = StreamRegistry.from_env()
+background_tasks = set()
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def save_then_release(permit, session_id, state, new_messages):
+    """Save a turn, then let the session's next turn run"""
+    try:
+        await save_turn(session_id, state, new_messages)
+    finally:
+        permit.release()
+
+async def cancel_on_disconnect(http_request: Request, task: asyncio.Task, disconnected: asyncio.Event):
+    """Cancel `task` as soon as the client closes the connection"""
+    while True:
+        message = await http_request.receive()
+        if message["type"] == "http.disconnect":
+            disconnected.set()
+            task.cancel()
+            return
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(request: ChatRequest):
     try:
         # Generate session ID if not provided
-        session_id = request.session_id or str(uuid.uuid4())
+        session_id = request.session_id or new_session_id()
         
         # Prepare the user message
         user_message = HumanMessage(content=request.message)
         
-        # Get or create session state
-        if session_id not in active_sessions:
-            initial_state = ChatState(messages=[])
-        else:
-            initial_state = active_sessions[session_id]
-        
-        # Add user message to state
-        initial_state['messages'].append(user_message)
-        
-        # Invoke the chatbot
-        result = chatbot.invoke(initial_state, config={"configurable": {"thread_id": session_id}})
-        
-        # Store updated state
-        active_sessions[session_id] = result
+        # Wait for a model slot and for earlier turns of this session
+        async with admission.admit(session_id):
+            # Load the session state and add the user message
+            state = await load_session(session_id) or ChatState(messages=[])
+            initial_state = {**state, 'messages': state['messages'] + [user_message]}
+            
+            # Invoke the chatbot without blocking the event loop
+            result = await chatbot.ainvoke(initial_state, config=thread_config(session_id))
+            
+            # Store updated state
+            session_store.put(session_id, result)
         
         # Get the AI response (last message should be AI response)
         ai_response = result['messages'][-1].content if result['messages'] else "I'm sorry, I couldn't process your request."
@@ -71,121 +180,317 @@ async def chat_endpoint(request: ChatRequest):
             status="success"
         )
         
+    except (Overloaded, UpstreamUnavailable):
+        raise
+    except UpstreamTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing chat: {str(e)}")
 
+async def stream_turn(session_id: str, user_message: HumanMessage, started: float):
+    """Run one streamed turn, yielding protocol events (shared by /chat/stream and /chat/ws)"""
+    streamed = []
+    permit = None
+    outcome = "error"
+    stream_stats["active"] += 1
+    try:
+        # Wait for a model slot and for earlier turns of this session
+        try:
+            permit = await admission.acquire(session_id)
+        except Overloaded as e:
+            outcome = "rejected"
+            yield {'type': 'error', 'error': 'Server is busy, retry later', 'retry_after': e.retry_after}
+            return
+        
+        # Load the session state, add the user message and fit it to the context window
+        state = await load_session(session_id) or ChatState(messages=[])
+        turn_state, context = await prepare_context({**state, 'messages': state['messages'] + [user_message]}, session_id)
+        
+        # Stream the response
+        async for chunk_data in stream_chat_response(context):
+            if chunk_data.get('error'):
+                error = {'type': 'error', 'error': chunk_data.get('message', 'Unknown error')}
+                if chunk_data.get('retry_after') is not None:
+                    error['retry_after'] = chunk_data['retry_after']
+                yield error
+                break
+            
+            elif chunk_data.get('partial', False):
+                # Send each chunk as it arrives
+                if not streamed:
+                    metrics.stream_first_chunk.observe(time.perf_counter() - started)
+                streamed.append(chunk_data['chunk'])
+                metrics.stream_chunks.inc()
+                metrics.stream_chars.inc(len(chunk_data['chunk']))
+                yield {'type': 'chunk', 'content': chunk_data['chunk']}
+            
+            else:
+                # Final message - store the complete state
+                full_response = chunk_data['full_response']
+                await save_turn(
+                    session_id,
+                    {**turn_state, 'messages': state['messages']},
+                    [user_message, AIMessage(content=full_response)]
+                )
+                
+                # Send completion signal
+                stream_stats["completed"] += 1
+                outcome = "completed"
+                yield {'type': 'complete', 'full_response': full_response}
+                break
+        
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client went away or cancelled the turn. Cancelling unwinds the
+        # upstream model stream; keep whatever was already sent as the
+        # answer. Saving runs in the background because this task is being
+        # cancelled; the session stays locked until it is done.
+        stream_stats["aborted"] += 1
+        outcome = "aborted"
+        if streamed:
+            run_in_background(save_then_release(
+                permit,
+                session_id,
+                {**turn_state, 'messages': state['messages']},
+                [user_message, AIMessage(content="".join(streamed))]
+            ))
+            permit = None
+        raise
+    except Exception as e:
+        yield {'type': 'error', 'error': str(e)}
+    finally:
+        stream_stats["active"] -= 1
+        metrics.stream_duration.labels(outcome).observe(time.perf_counter() - started)
+        if permit is not None:
+            permit.release()
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "Content-Type": "text/event-stream",
+}
+
+async def sse_frames(stream_id: str, session_id: str, user_message: HumanMessage, started: float):
+    """Encode one streamed turn as SSE frames"""
+    encode_chunk = chunk_encoder(session_id)
+    yield encode_event({'type': 'session_start', 'session_id': session_id, 'stream_id': stream_id})
+    turn = stream_turn(session_id, user_message, started)
+    try:
+        async for event in turn:
+            if event['type'] == 'chunk':
+                yield encode_chunk(event['content'])
+            else:
+                yield encode_event({**event, 'session_id': session_id})
+    finally:
+        await turn.aclose()
+
+def follow_stream(buffer: StreamBuffer, http_request: Request, after: int = 0, resumed: bool = False):
+    """SSE response relaying `buffer` from frame `after` on, until the client goes away"""
+    async def relay():
+        disconnected = asyncio.Event()
+        watcher = asyncio.create_task(cancel_on_disconnect(http_request, asyncio.current_task(), disconnected))
+        frames = streams.follow(buffer, after, resumed)
+        try:
+            async for frame in frames:
+                yield frame
+        except StreamGone as e:
+            yield encode_event({'type': 'error', 'error': str(e), 'session_id': buffer.session_id})
+        except asyncio.CancelledError:
+            # The client went away; the turn keeps running for a while in case it reconnects
+            if disconnected.is_set():
+                asyncio.current_task().uncancel()
+                return
+            raise
+        finally:
+            watcher.cancel()
+            await frames.aclose()
+
+    return StreamingResponse(relay(), media_type="text/plain", headers=SSE_HEADERS)
+
+def resume_stream(stream_id: str, after: int, http_request: Request):
+    try:
+        buffer = streams.get(stream_id)
+    except StreamGone as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    if after + 1 < buffer.first_seq:
+        raise HTTPException(status_code=410, detail=f"Events before {buffer.first_seq} are no longer buffered")
+    return follow_stream(buffer, http_request, after, resumed=True)
+
+def last_event_id(http_request: Request, fallback: Optional[str] = None):
+    """(stream_id, seq) from the Last-Event-ID header or `fallback`, or None"""
+    value = http_request.headers.get("last-event-id") or fallback
+    if not value:
+        return None
+    try:
+        return parse_event_id(value)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/chat/stream")
-async def chat_stream_endpoint(request: ChatRequest):
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request):
     """Streaming chat endpoint that returns responses word by word"""
+    started = time.perf_counter()
+
+    # A client reconnecting after a dropped connection continues the same answer
+    resume_from = last_event_id(http_request)
+    if resume_from is not None:
+        return resume_stream(*resume_from, http_request)
+
     try:
-        session_id = request.session_id or str(uuid.uuid4())
+        session_id = request.session_id or new_session_id()
         
-        async def generate_stream():
-            try:
-                # Prepare the user message
-                user_message = HumanMessage(content=request.message)
-                
-                # Get or create session state
-                if session_id not in active_sessions:
-                    initial_state = ChatState(messages=[])
-                else:
-                    initial_state = active_sessions[session_id].copy()
-                
-                # Add user message to state
-                messages = initial_state.get('messages', []) + [user_message]
-                
-                # Send initial response with session info
-                yield f"data: {json.dumps({'type': 'session_start', 'session_id': session_id})}\n\n"
-                
-                # Stream the response
-                full_response = ""
-                async for chunk_data in stream_chat_response(messages):
-                    if chunk_data.get('error'):
-                        error_data = {
-                            'type': 'error',
-                            'error': chunk_data.get('message', 'Unknown error'),
-                            'session_id': session_id
-                        }
-                        yield f"data: {json.dumps(error_data)}\n\n"
-                        break
-                    
-                    elif chunk_data.get('partial', False):
-                        # Send each chunk as it arrives
-                        chunk_response = {
-                            'type': 'chunk',
-                            'content': chunk_data['chunk'],
-                            'session_id': session_id
-                        }
-                        yield f"data: {json.dumps(chunk_response)}\n\n"
-                        full_response = chunk_data['full_response']
-                        
-                        # Small delay for smooth streaming effect
-                        await asyncio.sleep(0.01)
-                    
-                    else:
-                        # Final message - store the complete state
-                        final_messages = messages + [AIMessage(content=full_response)]
-                        active_sessions[session_id] = ChatState(messages=final_messages)
-                        
-                        # Send completion signal
-                        completion_data = {
-                            'type': 'complete',
-                            'full_response': full_response,
-                            'session_id': session_id
-                        }
-                        yield f"data: {json.dumps(completion_data)}\n\n"
-                        break
-                
-            except Exception as e:
-                error_data = {
-                    'type': 'error',
-                    'error': str(e),
-                    'session_id': session_id
-                }
-                yield f"data: {json.dumps(error_data)}\n\n"
+        # Reject up front while the response status can still be 429
+        admission.check()
         
-        return StreamingResponse(
-            generate_stream(),
-            media_type="text/plain",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Content-Type": "text/event-stream",
-            }
-        )
+        # Stream ids are issued like session ids, so they are owned by this worker too
+        stream_id = new_session_id()
+        buffer = streams.start(stream_id, session_id, sse_frames(stream_id, session_id, HumanMessage(content=request.message), started))
+        return follow_stream(buffer, http_request)
         
+    except Overloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing streaming chat: {str(e)}")
 
+@app.get("/chat/stream/{stream_id}")
+async def resume_chat_stream(stream_id: str, http_request: Request, last_event_id_param: Optional[str] = Query(None, alias="last_event_id")):
+    """Resume a /chat/stream answer after the last event the client received (from the start without one)"""
+    resume_from = last_event_id(http_request, last_event_id_param)
+    if resume_from is not None and resume_from[0] != stream_id:
+        raise HTTPException(status_code=400, detail="Last-Event-ID belongs to a different stream")
+    return resume_stream(stream_id, resume_from[1] if resume_from else 0, http_request)
+
+@app.websocket("/chat/ws")
+async def chat_websocket(websocket: WebSocket, session_id: Optional[str] = None):
+    """Persistent chat connection: many turns over one socket, with heartbeats and backpressure"""
+    session_id = session_id or new_session_id()
+    await websocket.accept()
+    connection = ChatConnection(
+        websocket,
+        session_id,
+        lambda content, started: stream_turn(session_id, HumanMessage(content=content), started),
+        websocket_settings,
+        websocket_stats,
+    )
+    websocket_stats["active"] += 1
+    try:
+        await connection.run()
+    finally:
+        websocket_stats["active"] -= 1
+
+# Largest page /chat/history returns, and messages per chunk of /chat/export
+HISTORY_MAX_LIMIT = 500
+EXPORT_BATCH = 64
+
+def history_item(index: int, record) -> dict:
+    return {"index": index, "role": api_role(record), "content": record.content}
+
 @app.get("/chat/history/{session_id}")
-async def get_chat_history(session_id: str):
-    if session_id not in active_sessions:
-        return {"messages": [], "status": "no_session_found"}
-    
-    messages = []
-    for msg in active_sessions[session_id]['messages']:
-        messages.append({
-            "content": msg.content,
-            "role": "user" if hasattr(msg, 'type') and msg.type == "human" else "assistant"
-        })
-    
-    return {"messages": messages, "status": "success"}
+async def get_chat_history(
+    session_id: str,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=HISTORY_MAX_LIMIT),
+    since: Optional[int] = Query(None, ge=0),
+):
+    """A session's messages: all of them, a page after `cursor`, or only those after the first `since`"""
+    if cursor is not None and since is not None:
+        raise HTTPException(status_code=400, detail="Use either cursor or since, not both")
+    if cursor is not None:
+        if not cursor.isdigit():
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        start = int(cursor)
+    else:
+        start = since or 0
+
+    history = await load_history(session_id)
+    if history is None:
+        return {"messages": [], "status": "no_session_found", "total": 0, "next_cursor": None}
+
+    # Histories only grow, so a cursor is the index of the next message
+    end = len(history) if limit is None else min(len(history), start + limit)
+    return {
+        "messages": [history_item(i, history[i]) for i in range(start, end)],
+        "status": "success",
+        "total": len(history),
+        "next_cursor": str(end) if end < len(history) else None,
+    }
+
+@app.get("/chat/export/{session_id}")
+async def export_chat(session_id: str):
+    """Stream a whole session as NDJSON: a header line, then one line per message"""
+    history = await load_history(session_id)
+    if history is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    async def lines():
+        yield dumps({"type": "session", "session_id": session_id, "messages": len(history)}) + "\n"
+        # The records are an immutable snapshot; they are encoded a batch at a time
+        for start in range(0, len(history), EXPORT_BATCH):
+            batch = history[start:start + EXPORT_BATCH]
+            yield "".join(
+                dumps({"type": "message", **history_item(index, record), "id": record.id}) + "\n"
+                for index, record in enumerate(batch, start)
+            )
+
+    filename = "".join(c if c.isalnum() or c in "-_" else "_" for c in session_id)[:64]
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="chat_{filename}.ndjson"'},
+    )
 
 @app.delete("/chat/session/{session_id}")
 async def clear_session(session_id: str):
-    if session_id in active_sessions:
-        del active_sessions[session_id]
+    async with admission.session(session_id):
+        cleared = await delete_history(session_id)
+    if cleared:
         return {"status": "session_cleared"}
     return {"status": "session_not_found"}
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "ChatBot API"}
+    return {
+        "status": "healthy" if startup["ready"] else "starting",
+        "service": "ChatBot API",
+        "startup": startup,
+        "model": {
+            "provider": MODEL_PROVIDER,
+            "loaded": model_loaded(),
+            "load_seconds": backend.model_load_seconds,
+        },
+        "sessions": session_store.stats(),
+        "response_cache": response_cache.stats(),
+        "single_flight": inflight_requests.stats(),
+        "upstream": backend.upstream.stats(),
+        "memory": backend.long_term_memory.stats() if backend.long_term_memory is not None else None,
+        "streams": stream_stats,
+        "resumable_streams": streams.stats(),
+        "websockets": websocket_stats,
+        "admission": admission.stats(),
+        "profiling": profiler.stats() if profiler is not None else None,
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
 
 def main():
     print("Hello from chatbot!")
 
 
 if __name__ == "__main__":
+    import argparse
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Run the ChatBot API")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes behind the session-affinity router (see cluster.py)")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--production", action="store_true", help="run without the auto-reloader")
+    args = parser.parse_args()
     main()
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    if args.workers > 1:
+        from cluster import run_cluster
+        run_cluster(args.workers, port=args.port)
+    elif args.production:
+        # Serve this module's app; importing "main:app" again would build a second app
+        uvicorn.run(app, host="0.0.0.0", port=args.port)
+    else:
+        uvicorn.run("main:app", host="0.0.0.0", port=args.port, reload=True)
@@ -0,0 +1,254 @@
+"""
+Prometheus-style metrics for the ChatBot API.
+
+A small dependency-free registry rendering the text exposition format. The
+hot path only increments counters and histogram buckets; anything derived
+from other components (session count, store memory, queue depth) is read
+through callbacks when `/metrics` is scraped.
+"""
+
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers fast cache hits up to long model answers
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        """Child for one combination of label values; keep it to skip the lookup"""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        if not self.labelnames:
+            self.labels()
+
+    def inc(self, amount: float = 1):
+        self._children[()].value += amount
+
+    def _new_child(self):
+        return CounterValue()
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{format_labels(self.labelnames, values)} {format_value(child.value)}"]
+
+
+class HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        if not self.labelnames:
+            self.labels()
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+    def _render_child(self, values, child):
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = f'le="{format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{format_labels(self.labelnames, values, le)} {cumulative}")
+        labels = format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class GaugeFunc(Metric):
+    """Gauge whose value is read from a callback at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}",
+                f"{self.name} {format_value(self.fn())}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float]) -> GaugeFunc:
+        existing = self._metrics.get(name)
+        if isinstance(existing, GaugeFunc):
+            # The module registering it was executed again (`python main.py` runs it as
+            # __main__ and then imports main:app); read from the newest components
+            existing.fn = fn
+            return existing
+        return self.register(GaugeFunc(name, help, fn))
+
+    def render(self) -> str:
+        """The whole registry in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# HTTP layer
+http_request_duration = registry.histogram(
+    "chat_http_request_duration_seconds", "Time from request to end of response",
+    ("method", "endpoint", "status"))
+
+# Streamed chat turns: /chat/stream (SSE) and /chat/ws (WebSocket)
+stream_first_chunk = registry.histogram(
+    "chat_stream_time_to_first_chunk_seconds", "Time to the first chunk of streamed chat turns (SSE and WebSocket)")
+stream_duration = registry.histogram(
+    "chat_stream_duration_seconds", "Total duration of streamed chat turns (SSE and WebSocket)", ("outcome",))
+stream_chunks = registry.counter("chat_stream_chunks_total", "Chunks sent in streamed chat turns (SSE and WebSocket)")
+stream_chars = registry.counter(
+    "chat_stream_characters_total", "Characters sent in streamed chat turns (SSE and WebSocket)")
+
+# Upstream model
+upstream_latency = registry.histogram(
+    "chat_upstream_latency_seconds", "Duration of upstream model calls", ("call",))
+upstream_errors = registry.counter(
+    "chat_upstream_errors_total", "Upstream model calls that failed", ("call",))
+upstream_retries = registry.counter(
+    "chat_upstream_retries_total", "Upstream attempts retried after a failure or timeout", ("call",))
+upstream_timeouts = registry.counter(
+    "chat_upstream_timeouts_total", "Upstream attempts that missed their deadline", ("call",))
+upstream_hedges = registry.counter(
+    "chat_upstream_hedges_total", "Hedged second attempts started for slow calls", ("call",))
+upstream_hedge_wins = registry.counter(
+    "chat_upstream_hedge_wins_total", "Hedged attempts that answered first", ("call",))
+upstream_rejections = registry.counter(
+    "chat_circuit_breaker_rejections_total", "Model calls refused while the circuit breaker was open")
+
+
+class Timer:
+    """Context manager observing elapsed seconds into a histogram child"""
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by route template"""
+
+    def __init__(self, app, skip_paths: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.skip_paths = frozenset(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            endpoint = getattr(route, "path", "unmatched")
+            http_request_duration.labels(scope["method"], endpoint, str(status)).observe(time.perf_counter() - start)
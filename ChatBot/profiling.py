@@ -0,0 +1,259 @@
+"""
+On-demand sampling profiles of API requests.
+
+With CHAT_PROFILE_DIR set, a request is profiled when its profiling header
+(`X-Profile`) carries the secret CHAT_PROFILE_TOKEN, or when it is picked by
+CHAT_PROFILE_SAMPLE_RATE. Without a token the header is ignored, so clients
+cannot start profiles on their own. While any
+profile is active, a background thread samples the event loop thread's stack
+every few milliseconds. Each sample is charged to the request that owns the
+running task. A ContextVar set by the middleware is inherited by every task
+the request starts (stream producers, hedged model calls), so their samples
+count too. Samples taken while the loop waits for sockets and timers are
+recorded as idle time, and samples taken while another request runs are
+recorded as time lost to it. Together the profile covers the request's
+whole wall time.
+
+Each profile is written as a collapsed-stack file (`frame;frame;frame count`
+per line), which flamegraph.pl, inferno and speedscope read directly. The
+response carries the profile id in `X-Profile-Id`. Without CHAT_PROFILE_DIR
+the middleware is not installed at all, so there is no cost.
+"""
+
+import asyncio
+import hmac
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+# The profile owning the current request, inherited by the tasks it starts
+current_profile: ContextVar[Optional["Profile"]] = ContextVar('current_profile', default=None)
+
+IDLE_FRAME = '[idle: waiting for network or timers]'
+OTHER_FRAME = '[other requests]'
+CALLBACK_FRAME = '[event loop callbacks]'
+# Event loop frames; everything above them is the same for every sample.
+# uvloop runs its loop in C, so there the stack ends at Runner.run
+LOOP_FRAMES = frozenset({
+    'Handle._run', 'BaseEventLoop._run_once', 'BaseEventLoop.run_forever',
+    'BaseEventLoop.run_until_complete', 'Runner.run',
+})
+
+
+class Profile:
+    """Stack samples collected for one request"""
+
+    def __init__(self, method: str, path: str):
+        self.profile_id = uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.samples: Counter = Counter()
+
+    def folded(self) -> str:
+        """Collapsed-stack text, heaviest stacks first"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def filename(self) -> str:
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', self.path).strip('_') or 'root'
+        return f"{time.strftime('%Y%m%dT%H%M%S')}-{self.method.lower()}-{slug[:60]}-{self.profile_id}.folded"
+
+
+class RequestProfiler:
+    """Selects requests to profile and samples the event loop while any profile is active"""
+
+    def __init__(
+        self,
+        output_dir: str,
+        sample_rate: float = 0.0,
+        header: str = 'x-profile',
+        token: Optional[str] = None,
+        interval_seconds: float = 0.005,
+        paths: Sequence[str] = ('/chat',),
+        max_active: int = 4,
+    ):
+        # token=None disables the header, leaving only sampled profiles
+        self.output_dir = Path(output_dir)
+        self.sample_rate = sample_rate
+        self.header = header.lower().encode('latin-1')
+        self.token = token
+        self.interval_seconds = interval_seconds
+        self.paths = tuple(paths)
+        self.max_active = max_active
+        self._active: Dict[str, Profile] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread = 0
+        self._labels: Dict[object, str] = {}
+        self.profiled = 0
+        self.skipped = 0
+        self.samples = 0
+        self.last_file: Optional[str] = None
+
+    @classmethod
+    def from_env(cls) -> Optional["RequestProfiler"]:
+        """Profiler writing to CHAT_PROFILE_DIR, or None when profiling is off"""
+        output_dir = os.getenv('CHAT_PROFILE_DIR')
+        if not output_dir:
+            return None
+        token = os.getenv('CHAT_PROFILE_TOKEN') or None
+        sample_rate = float(os.getenv('CHAT_PROFILE_SAMPLE_RATE', '0'))
+        if token is None:
+            if sample_rate <= 0:
+                logger.warning("CHAT_PROFILE_DIR is set without CHAT_PROFILE_TOKEN or a sample rate; profiling is off")
+                return None
+            logger.warning("CHAT_PROFILE_TOKEN is not set; only sampled requests are profiled")
+        return cls(
+            output_dir=output_dir,
+            sample_rate=sample_rate,
+            header=os.getenv('CHAT_PROFILE_HEADER', 'X-Profile'),
+            token=token,
+            interval_seconds=float(os.getenv('CHAT_PROFILE_INTERVAL_MS', '5')) / 1000,
+            paths=[p for p in os.getenv('CHAT_PROFILE_PATHS', '/chat').split(',') if p],
+            max_active=int(os.getenv('CHAT_PROFILE_MAX_ACTIVE', '4')),
+        )
+
+    def wants(self, scope) -> bool:
+        """Whether to profile the request described by an ASGI `scope`"""
+        if not scope['path'].startswith(self.paths):
+            return False
+        if self.token is not None:
+            for name, value in scope['headers']:
+                if name == self.header:
+                    return hmac.compare_digest(value, self.token.encode('latin-1'))
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, method: str, path: str) -> Optional[Profile]:
+        """Begin profiling on the running loop; None if too many profiles are active"""
+        with self._lock:
+            if len(self._active) >= self.max_active:
+                self.skipped += 1
+                return None
+            profile = Profile(method, path)
+            self._active[profile.profile_id] = profile
+            self._loop = asyncio.get_running_loop()
+            self._loop_thread = threading.get_ident()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+        return profile
+
+    def finish(self, profile: Profile):
+        """Stop sampling for `profile`"""
+        with self._lock:
+            self._active.pop(profile.profile_id, None)
+
+    def write(self, profile: Profile) -> Path:
+        """Write the collapsed stacks of a finished profile"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        path = self.output_dir / profile.filename()
+        path.write_text(profile.folded(), encoding='utf-8')
+        self.profiled += 1
+        self.last_file = str(path)
+        logger.info("Profiled %s %s: %d samples over %.3fs -> %s", profile.method, profile.path,
+                    sum(profile.samples.values()), time.perf_counter() - profile.started, path)
+        return path
+
+    def stats(self) -> dict:
+        return {
+            'active': len(self._active),
+            'profiled': self.profiled,
+            'skipped': self.skipped,
+            'samples': self.samples,
+            'output_dir': str(self.output_dir),
+            'last_file': self.last_file,
+        }
+
+    def _run(self):
+        # Runs only while some profile is active
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                self._sample()
+            time.sleep(self.interval_seconds)
+
+    def _sample(self):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        task = asyncio.current_task(self._loop)
+        owner = task.get_context().get(current_profile) if task is not None else None
+        stack = self._stack(frame)
+        self.samples += 1
+        if task is None:
+            # Between tasks: either waiting in the selector or running transport/protocol callbacks
+            stack = f"{CALLBACK_FRAME};{stack}" if stack else IDLE_FRAME
+            for profile in self._active.values():
+                profile.samples[stack] += 1
+            return
+        for profile in self._active.values():
+            profile.samples[(stack or IDLE_FRAME) if profile is owner else OTHER_FRAME] += 1
+
+    def _stack(self, frame) -> str:
+        """Frames below the event loop, root first; empty while the loop waits for I/O"""
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            if code.co_filename.endswith('selectors.py'):
+                return ""
+            if code.co_qualname in LOOP_FRAMES:
+                break
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = f"{code.co_qualname} ({short_path(code.co_filename)})".replace(';', ',')
+            labels.append(label)
+            frame = frame.f_back
+        return ";".join(reversed(labels))
+
+
+def short_path(filename: str) -> str:
+    """`package/module.py` for installed packages, the file name for everything else"""
+    for marker in ('site-packages/', 'dist-packages/'):
+        if marker in filename:
+            return filename.split(marker, 1)[1]
+    return os.path.basename(filename)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling the HTTP requests a RequestProfiler selects"""
+
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.wants(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = self.profiler.start(scope["method"], scope["path"])
+        if profile is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile.profile_id.encode())]
+            await send(message)
+
+        token = current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_profile.reset(token)
+            self.profiler.finish(profile)
+            await asyncio.to_thread(self.profiler.write, profile)
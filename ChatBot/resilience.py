@@ -0,0 +1,305 @@
+"""
+Deadlines, retries, hedged requests and a circuit breaker for model calls.
+
+Gemini's latency has a long tail and it occasionally fails outright. Every
+upstream call goes through an UpstreamPolicy:
+
+- Deadlines: each attempt must produce its first chunk within
+  `first_chunk_timeout`, and the whole call must finish within `timeout`.
+- Retries: a failed or timed-out attempt is retried after a full-jitter
+  exponential backoff, as long as nothing has been streamed yet.
+- Hedging: when the first chunk is later than the `hedge_percentile` of
+  recent first-chunk latencies, a second attempt is started. Whichever
+  answers first is kept and the other is cancelled.
+- Circuit breaker: after `failures` consecutive failed attempts, calls fail
+  fast with UpstreamUnavailable for `reset_seconds`. Then a single probe
+  call decides whether to close the breaker again.
+
+Once a chunk has reached the caller a failure is passed on, because
+retrying would repeat text the caller already has.
+"""
+
+import asyncio
+import math
+import os
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from metrics import upstream_hedge_wins, upstream_hedges, upstream_rejections, upstream_retries, upstream_timeouts
+
+# Configuration and programming errors; retrying cannot fix them
+NON_RETRYABLE = (ValueError, TypeError, KeyError, AttributeError, NotImplementedError)
+
+# First-chunk latencies remembered per call type, and how many are needed
+# before hedging starts
+LATENCY_WINDOW = 256
+MIN_HEDGE_SAMPLES = 20
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling the model while the circuit breaker is open"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("The model is temporarily unavailable, retry later")
+        self.retry_after = retry_after
+
+
+class UpstreamTimeout(TimeoutError):
+    """Raised when an upstream call misses its deadline"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open probe"""
+
+    CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+
+    def __init__(self, failures: int = 5, reset_seconds: float = 30.0):
+        # failures=0 disables the breaker
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    def before_call(self) -> bool:
+        """Raise UpstreamUnavailable unless a call may go upstream; True if it is the probe"""
+        if self.state == self.CLOSED:
+            return False
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        self.rejected += 1
+        upstream_rejections.inc()
+        raise UpstreamUnavailable(self.retry_after())
+
+    def end_probe(self):
+        # A probe that was cancelled decided nothing; let the next call try
+        self.probing = False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.state = self.CLOSED
+        self.probing = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.failures and (self.state == self.HALF_OPEN or self.consecutive_failures >= self.failures):
+            if self.state != self.OPEN:
+                self.opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.opened_at + self.reset_seconds - time.monotonic()))
+
+    def stats(self) -> dict:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'opened': self.opened,
+            'rejected': self.rejected,
+        }
+
+
+class UpstreamPolicy:
+    """Deadlines, retries and hedging around one upstream, guarded by a circuit breaker"""
+
+    def __init__(
+        self,
+        timeout: float = 300.0,
+        first_chunk_timeout: float = 30.0,
+        retries: int = 2,
+        backoff: float = 0.25,
+        backoff_max: float = 4.0,
+        hedge_percentile: float = 0.0,
+        hedge_min_delay: float = 0.5,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        # timeout/first_chunk_timeout=0 wait forever; hedge_percentile=0 disables hedging
+        self.timeout = timeout
+        self.first_chunk_timeout = first_chunk_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = breaker or CircuitBreaker()
+        self._latencies: Dict[str, deque] = {}
+        self.calls = 0
+        self.retried = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @classmethod
+    def from_env(cls) -> "UpstreamPolicy":
+        """Build a policy from CHAT_MODEL_* and CHAT_BREAKER_* environment variables"""
+        return cls(
+            timeout=float(os.getenv('CHAT_MODEL_TIMEOUT', '300')),
+            first_chunk_timeout=float(os.getenv('CHAT_MODEL_FIRST_CHUNK_TIMEOUT', '30')),
+            retries=int(os.getenv('CHAT_MODEL_RETRIES', '2')),
+            backoff=float(os.getenv('CHAT_MODEL_BACKOFF', '0.25')),
+            backoff_max=float(os.getenv('CHAT_MODEL_BACKOFF_MAX', '4')),
+            hedge_percentile=float(os.getenv('CHAT_MODEL_HEDGE_PERCENTILE', '0')),
+            hedge_min_delay=float(os.getenv('CHAT_MODEL_HEDGE_MIN_DELAY', '0.5')),
+            breaker=CircuitBreaker(
+                failures=int(os.getenv('CHAT_BREAKER_FAILURES', '5')),
+                reset_seconds=float(os.getenv('CHAT_BREAKER_RESET', '30')),
+            ),
+        )
+
+    def hedge_delay(self, call: str) -> Optional[float]:
+        """Seconds to wait for a first chunk before hedging, or None to not hedge"""
+        samples = self._latencies.get(call)
+        if not self.hedge_percentile or samples is None or len(samples) < MIN_HEDGE_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))
+        return max(self.hedge_min_delay, ordered[index])
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Full-jitter exponential backoff before retry number `attempt`"""
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** (attempt - 1)))
+
+    async def stream(self, factory: Callable[[], AsyncIterator], call: str, first_chunk_timeout: Optional[float] = None):
+        """Yield the chunks of `factory()`, applying the policy to the call"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout if self.timeout else math.inf
+        first_chunk_timeout = self.first_chunk_timeout if first_chunk_timeout is None else first_chunk_timeout
+        self.calls += 1
+        probe = self.breaker.before_call()
+        source = None
+        try:
+            attempt = 0
+            while True:
+                try:
+                    source, first = await self._first_chunk(factory, call, deadline, first_chunk_timeout)
+                    break
+                except NON_RETRYABLE:
+                    raise
+                except Exception:
+                    attempt += 1
+                    delay = self.backoff_delay(attempt)
+                    if attempt > self.retries or loop.time() + delay >= deadline:
+                        raise
+                    self.retried += 1
+                    upstream_retries.labels(call).inc()
+                    await asyncio.sleep(delay)
+                    probe = self.breaker.before_call() or probe
+
+            if first is StopAsyncIteration:
+                return
+            yield first
+            while True:
+                remaining = deadline - loop.time()
+                try:
+                    chunk = await asyncio.wait_for(anext(source), None if remaining == math.inf else max(0.0, remaining))
+                except StopAsyncIteration:
+                    return
+                except TimeoutError:
+                    self._timed_out(call)
+                    raise UpstreamTimeout(f"The model did not finish within {self.timeout:.3g}s") from None
+                except NON_RETRYABLE:
+                    raise
+                except Exception:
+                    self.breaker.record_failure()
+                    raise
+                yield chunk
+        finally:
+            if probe:
+                self.breaker.end_probe()
+            if source is not None:
+                await source.aclose()
+
+    async def call(self, fn: Callable[[], Awaitable], call: str):
+        """Await `fn()` under the policy; its result counts as the first chunk"""
+        async def once():
+            yield await fn()
+
+        results = self.stream(once, call, first_chunk_timeout=self.timeout)
+        try:
+            return await anext(results)
+        finally:
+            await results.aclose()
+
+    async def _first_chunk(self, factory, call: str, deadline: float, first_chunk_timeout: float):
+        """Run one attempt, hedged if it is slow; returns the winner's (source, first chunk)"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        first_deadline = min(deadline, started + first_chunk_timeout) if first_chunk_timeout else deadline
+        hedge_delay = self.hedge_delay(call)
+        hedge_at = started + hedge_delay if hedge_delay is not None else math.inf
+        attempts = {}  # task -> (source, launched, is_hedge)
+
+        def launch(is_hedge: bool):
+            source = aiter(factory())
+            attempts[asyncio.ensure_future(anext(source))] = (source, loop.time(), is_hedge)
+
+        launch(False)
+        hedged = False
+        error = None
+        try:
+            while attempts:
+                wake = first_deadline if hedged else min(hedge_at, first_deadline)
+                timeout = None if wake == math.inf else max(0.0, wake - loop.time())
+                done, _ = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if not hedged and hedge_at < first_deadline and loop.time() >= hedge_at:
+                        hedged = True
+                        self.hedges += 1
+                        upstream_hedges.labels(call).inc()
+                        launch(True)
+                        continue
+                    self._timed_out(call)
+                    raise UpstreamTimeout(f"No response from the model within {first_deadline - started:.3g}s")
+                for task in done:
+                    source, launched, is_hedge = attempts.pop(task)
+                    try:
+                        first = task.result()
+                    except StopAsyncIteration:
+                        first = StopAsyncIteration  # An empty answer is still an answer
+                    except Exception as e:
+                        if not isinstance(e, NON_RETRYABLE):
+                            self.breaker.record_failure()
+                        error = e
+                        await source.aclose()
+                        continue
+                    self._latencies.setdefault(call, deque(maxlen=LATENCY_WINDOW)).append(loop.time() - launched)
+                    if is_hedge:
+                        self.hedge_wins += 1
+                        upstream_hedge_wins.labels(call).inc()
+                    self.breaker.record_success()
+                    return source, first
+            raise error
+        finally:
+            # Cancel the slower attempt, if any, and close its stream
+            for task in attempts:
+                task.cancel()
+            await asyncio.gather(*attempts, return_exceptions=True)
+            for source, _, _ in attempts.values():
+                await source.aclose()
+
+    def _timed_out(self, call: str):
+        self.timeouts += 1
+        upstream_timeouts.labels(call).inc()
+        self.breaker.record_failure()
+
+    def stats(self) -> dict:
+        """Counters for monitoring the upstream"""
+        return {
+            'calls': self.calls,
+            'retries': self.retried,
+            'timeouts': self.timeouts,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'hedge_delay': {call: self.hedge_delay(call) for call in self._latencies},
+            'breaker': self.breaker.stats(),
+        }
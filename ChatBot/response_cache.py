@@ -0,0 +1,130 @@
+"""
+Response cache for repeated prompts.
+
+Keyed on a normalized hash of exactly what the model would see (message
+roles and contents, model name and temperature), so the same opening
+question is answered once and replayed afterwards. Entries keep the
+streamed chunks so a hit can be replayed chunk by chunk.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage
+
+
+def normalize_content(content) -> str:
+    """Collapse whitespace so trivially different prompts share an entry"""
+    if not isinstance(content, str):
+        content = json.dumps(content, sort_keys=True)
+    return " ".join(content.split())
+
+
+def cache_key(messages: List[BaseMessage], model_name: str, temperature) -> str:
+    """Stable hash of the model input"""
+    payload = json.dumps(
+        [model_name, temperature, [(m.type, normalize_content(m.content)) for m in messages]],
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    chunks: Tuple[str, ...]
+    size_bytes: int
+    created: float = field(default_factory=time.monotonic)
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+
+class ResponseCache:
+    """LRU + TTL bounded cache of model responses"""
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 32 * 2**20, ttl_seconds: float = 3600):
+        # max_entries=0 disables the cache; max_bytes/ttl_seconds=0 disable that bound
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        """Build a cache from CHAT_RESPONSE_CACHE_* environment variables"""
+        return cls(
+            max_entries=int(os.getenv('CHAT_RESPONSE_CACHE_SIZE', '1024')),
+            max_bytes=int(os.getenv('CHAT_RESPONSE_CACHE_MAX_BYTES', str(32 * 2**20))),
+            ttl_seconds=float(os.getenv('CHAT_RESPONSE_CACHE_TTL', '3600')),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Return the cached entry, or None on a miss"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds and time.monotonic() - entry.created > self.ttl_seconds:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, chunks: List[str]):
+        """Cache a complete response; empty responses are not cached"""
+        if not self.enabled or not any(chunks):
+            return
+        entry = CacheEntry(chunks=tuple(chunks), size_bytes=sum(sys.getsizeof(c) for c in chunks))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size_bytes
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes and self._bytes > self.max_bytes and len(self._entries) > 1):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Counters for monitoring hit rate and memory use"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size_bytes
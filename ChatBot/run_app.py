@@ -2,14 +2,25 @@
 """
 Startup script for the ChatBot application
 Runs both backend and frontend servers
+
+    python run_app.py               # development: install requirements, auto-reload
+    python run_app.py --production  # no install step, no reloader
 """
 
+import argparse
+import json
 import subprocess
 import sys
 import time
-import os
+import urllib.error
+import urllib.request
 from pathlib import Path
 
+BACKEND_PORT = 8000
+FRONTEND_PORT = 8501
+BACKEND_HEALTH_URL = f"http://localhost:{BACKEND_PORT}/health"
+FRONTEND_HEALTH_URL = f"http://localhost:{FRONTEND_PORT}/_stcore/health"
+
 def install_requirements():
     """Install required packages"""
     print("📦 Installing requirements...")
@@ -20,65 +31,124 @@ def install_requirements():
         print("❌ Failed to install requirements")
         sys.exit(1)
 
-def start_backend():
+def start_backend(reload: bool = True, workers: int = 1):
     """Start the FastAPI backend server"""
     print("🚀 Starting backend server...")
-    backend_cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "0.0.0.0", "--port", "8000", "--reload"]
+    if workers > 1:
+        # Session-affinity router in front of one process per worker
+        backend_cmd = [sys.executable, "cluster.py", "--workers", str(workers), "--port", str(BACKEND_PORT)]
+        return subprocess.Popen(backend_cmd)
+    backend_cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "0.0.0.0", "--port", str(BACKEND_PORT)]
+    if reload:
+        backend_cmd.append("--reload")
     return subprocess.Popen(backend_cmd)
 
-def start_frontend():
+def start_frontend(headless: bool = False):
     """Start the Streamlit frontend"""
     print("🎨 Starting frontend server...")
-    frontend_cmd = [sys.executable, "-m", "streamlit", "run", "frontend.py", "--server.port", "8501", "--server.address", "0.0.0.0"]
+    frontend_cmd = [sys.executable, "-m", "streamlit", "run", "frontend.py", "--server.port", str(FRONTEND_PORT), "--server.address", "0.0.0.0"]
+    if headless:
+        frontend_cmd += ["--server.headless", "true"]
     return subprocess.Popen(frontend_cmd)
 
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float, check=None):
+    """Poll `url` until it answers 200 (and `check(body)` passes); returns the body or None"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return None  # The server exited during startup
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                body = response.read()
+                if response.status == 200 and (check is None or check(body)):
+                    return body
+        except (urllib.error.URLError, ConnectionError, TimeoutError):
+            pass
+        time.sleep(0.05)
+    return None
+
+def backend_is_ready(body: bytes) -> bool:
+    return json.loads(body).get("status") == "healthy"
+
+def stop(processes):
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
 def main():
+    parser = argparse.ArgumentParser(description="Run the ChatBot backend and frontend")
+    parser.add_argument("--production", action="store_true",
+                        help="skip installing requirements and run without the auto-reloader")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="backend worker processes; more than one runs them behind the session-affinity "
+                             "router (cluster.py), without the auto-reloader")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for each server to become ready")
+    args = parser.parse_args()
+
     print("🤖 ChatBot Application Startup")
     print("=" * 40)
-    
+
     # Check if we're in the right directory
     if not Path("backend.py").exists():
         print("❌ Please run this script from the ChatBot directory")
         sys.exit(1)
-    
-    # Install requirements
-    install_requirements()
-    
+
+    # Install requirements (development only; production images are prebuilt)
+    if not args.production:
+        install_requirements()
+
     print("\n🔧 Starting services...")
-    
+    processes = []
+
     try:
-        # Start backend
-        backend_process = start_backend()
-        time.sleep(3)  # Give backend time to start
-        
+        started = time.perf_counter()
+
+        # Start backend and wait until /health reports ready
+        backend_process = start_backend(reload=not args.production, workers=args.workers)
+        processes.append(backend_process)
+        body = wait_until_ready(BACKEND_HEALTH_URL, backend_process, args.timeout, backend_is_ready)
+        if body is None:
+            print(f"❌ Backend did not become ready within {args.timeout:.0f}s")
+            stop(processes)
+            sys.exit(1)
+        backend_ready = time.perf_counter() - started
+        health = json.loads(body)
+        for startup in [w.get("startup", {}) for w in health.get("workers", [health])]:
+            print(f"✅ Backend ready in {backend_ready:.2f}s "
+                  f"(imports {startup.get('import_seconds', 0):.2f}s, app startup {startup.get('ready_seconds', 0):.2f}s)")
+
         # Start frontend
-        frontend_process = start_frontend()
-        
-        print("\n✅ Both servers are starting up!")
-        print("📍 Backend API: http://localhost:8000")
-        print("🌐 Frontend UI: http://localhost:8501")
+        frontend_process = start_frontend(headless=args.production)
+        processes.append(frontend_process)
+        if wait_until_ready(FRONTEND_HEALTH_URL, frontend_process, args.timeout) is None:
+            print(f"❌ Frontend did not become ready within {args.timeout:.0f}s")
+            stop(processes)
+            sys.exit(1)
+        print(f"✅ Frontend ready in {time.perf_counter() - started:.2f}s")
+
+        print("\n✅ Both servers are running!")
+        print(f"📍 Backend API: http://localhost:{BACKEND_PORT}")
+        print(f"🌐 Frontend UI: http://localhost:{FRONTEND_PORT}")
         print("\n💡 Tips:")
-        print("- Wait a few seconds for both servers to fully start")
         print("- The frontend will show connection status")
         print("- Press Ctrl+C to stop both servers")
-        
+
         # Wait for both processes
-        try:
-            backend_process.wait()
-        except KeyboardInterrupt:
-            print("\n🛑 Shutting down servers...")
-            backend_process.terminate()
-            frontend_process.terminate()
-            
-            # Wait for graceful shutdown
-            backend_process.wait(timeout=5)
-            frontend_process.wait(timeout=5)
-            
-            print("✅ Servers stopped successfully!")
-    
+        backend_process.wait()
+
+    except KeyboardInterrupt:
+        print("\n🛑 Shutting down servers...")
+        stop(processes)
+        print("✅ Servers stopped successfully!")
     except Exception as e:
         print(f"❌ Error starting servers: {e}")
+        stop(processes)
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,207 @@
+"""
+Bounded in-memory session store for the ChatBot API.
+
+Holds the state of every conversation (message history plus the running
+summary) in one place, with LRU eviction by session count and approximate
+size, and an idle TTL. Histories are kept as compact records (see
+compact_messages.py) and sessions idle for longer than `compress_after` are
+compressed; both are undone transparently on access.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
+
+from compact_messages import Record, pack, record_bytes, to_messages, to_records, unpack
+
+# Fixed cost of an entry: the entry object, its state dict and its key
+ENTRY_OVERHEAD_BYTES = 400
+
+
+@dataclass(slots=True)
+class SessionEntry:
+    # Everything but the messages (summary, summarized count)
+    state: dict
+    history: Optional[Tuple[Record, ...]]
+    size_bytes: int
+    packed: Optional[bytes] = None  # compressed history of an idle session
+    last_access: float = field(default_factory=time.monotonic)
+
+
+def history_bytes(history: Tuple[Record, ...], state: dict) -> int:
+    """Approximate memory held by one session"""
+    return ENTRY_OVERHEAD_BYTES + sum(record_bytes(r) for r in history) + \
+        sys.getsizeof(state.get('summary', ''))
+
+
+class SessionStore:
+    """LRU + TTL bounded mapping of session_id to chat state"""
+
+    def __init__(self, max_sessions: int = 10_000, max_bytes: int = 256 * 2**20, ttl_seconds: float = 24 * 3600,
+                 compress_after: float = 300):
+        # A limit of 0 disables that bound
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.compress_after = compress_after
+        self._sessions: "OrderedDict[str, SessionEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions_lru = 0
+        self.evictions_ttl = 0
+        self.compressed = 0
+        self.compressions = 0
+        self.decompressions = 0
+        self._last_sweep = time.monotonic()
+
+    @classmethod
+    def from_env(cls) -> "SessionStore":
+        """Build a store from CHAT_SESSION_* environment variables"""
+        return cls(
+            max_sessions=int(os.getenv('CHAT_SESSION_MAX_SESSIONS', '10000')),
+            max_bytes=int(os.getenv('CHAT_SESSION_MAX_BYTES', str(256 * 2**20))),
+            ttl_seconds=float(os.getenv('CHAT_SESSION_TTL', str(24 * 3600))),
+            compress_after=float(os.getenv('CHAT_SESSION_COMPRESS_AFTER', '300')),
+        )
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def get(self, session_id: str) -> Optional[dict]:
+        """Return a copy of the session's state, or None if unknown or expired"""
+        with self._lock:
+            entry = self._touch(session_id)
+            if entry is None:
+                return None
+            state, history = entry.state, entry.history
+        # Messages are rebuilt outside the lock; records are immutable
+        return {**state, 'messages': to_messages(history)}
+
+    def get_history(self, session_id: str) -> Optional[Tuple[Record, ...]]:
+        """The session's history as records, without rebuilding messages"""
+        with self._lock:
+            entry = self._touch(session_id)
+            return None if entry is None else entry.history
+
+    def put(self, session_id: str, state: dict):
+        """Replace the session's state and enforce the bounds"""
+        history = to_records(state.get('messages', []))
+        state = {k: v for k, v in state.items() if k != 'messages'}
+        size = history_bytes(history, state)
+        with self._lock:
+            if session_id in self._sessions:
+                self._remove(session_id)
+            self._sessions[session_id] = SessionEntry(state=state, history=history, size_bytes=size)
+            self._bytes += size
+            self._evict()
+            if self.compress_after and time.monotonic() - self._last_sweep > self.compress_after / 2:
+                self._compress_idle(self.compress_after)
+
+    def delete(self, session_id: str) -> bool:
+        """Drop a session; returns False if it did not exist"""
+        with self._lock:
+            if session_id not in self._sessions:
+                return False
+            self._remove(session_id)
+            return True
+
+    def compress_idle(self, idle_seconds: Optional[float] = None) -> int:
+        """Compress sessions idle for longer than `idle_seconds` (default: compress_after); returns how many"""
+        with self._lock:
+            return self._compress_idle(self.compress_after if idle_seconds is None else idle_seconds)
+
+    def stats(self) -> dict:
+        """Counters for monitoring memory use and eviction"""
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'bytes': self._bytes,
+                'max_sessions': self.max_sessions,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions_lru': self.evictions_lru,
+                'evictions_ttl': self.evictions_ttl,
+                'compress_after': self.compress_after,
+                'compressed': self.compressed,
+                'compressions': self.compressions,
+                'decompressions': self.decompressions,
+            }
+
+    def _expired(self, entry: SessionEntry, now: float) -> bool:
+        return bool(self.ttl_seconds) and now - entry.last_access > self.ttl_seconds
+
+    def _touch(self, session_id: str) -> Optional[SessionEntry]:
+        entry = self._sessions.get(session_id)
+        now = time.monotonic()
+        if entry is not None and self._expired(entry, now):
+            self._remove(session_id)
+            self.evictions_ttl += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.packed is not None:
+            entry.history = unpack(entry.packed)
+            entry.packed = None
+            self._resize(entry, history_bytes(entry.history, entry.state))
+            self.compressed -= 1
+            self.decompressions += 1
+        entry.last_access = now
+        self._sessions.move_to_end(session_id)
+        self.hits += 1
+        return entry
+
+    def _remove(self, session_id: str):
+        entry = self._sessions.pop(session_id)
+        self._bytes -= entry.size_bytes
+        if entry.packed is not None:
+            self.compressed -= 1
+
+    def _resize(self, entry: SessionEntry, size: int):
+        self._bytes += size - entry.size_bytes
+        entry.size_bytes = size
+
+    def _compress_idle(self, idle_seconds: float) -> int:
+        # Entries are in access order, so the idle ones are all at the front
+        now = time.monotonic()
+        self._last_sweep = now
+        count = 0
+        for entry in self._sessions.values():
+            if now - entry.last_access < idle_seconds:
+                break
+            if entry.packed is not None or not entry.history:
+                continue
+            entry.packed = pack(entry.history)
+            entry.history = None
+            self._resize(entry, ENTRY_OVERHEAD_BYTES + sys.getsizeof(entry.packed) +
+                         sys.getsizeof(entry.state.get('summary', '')))
+            count += 1
+        self.compressed += count
+        self.compressions += count
+        return count
+
+    def _evict(self):
+        # Entries are kept in access order, so expired and least recently
+        # used sessions are both at the front
+        now = time.monotonic()
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if self._expired(entry, now):
+                self.evictions_ttl += 1
+            elif (self.max_sessions and len(self._sessions) > self.max_sessions) or \
+                    (self.max_bytes and self._bytes > self.max_bytes and len(self._sessions) > 1):
+                self.evictions_lru += 1
+            else:
+                break
+            self._remove(session_id)
@@ -0,0 +1,101 @@
+"""
+Single-flight coalescing of identical in-flight model requests.
+
+The first request for a key starts one upstream stream in a background task;
+identical requests arriving while it runs subscribe to the same stream. Every
+subscriber receives all chunks from the start, so late joiners first get the
+prefix that was already emitted. The upstream call is cancelled only when its
+last subscriber goes away.
+"""
+
+import asyncio
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+
+class Flight:
+    """One upstream stream and the chunks it has produced so far"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.changed = asyncio.Condition()
+
+    async def notify(self):
+        async with self.changed:
+            self.changed.notify_all()
+
+
+class SingleFlight:
+    """Registry of in-flight upstream streams keyed by model input"""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': len(self._flights),
+            'upstream_calls': self.leaders,
+            'coalesced': self.followers,
+        }
+
+    async def subscribe(
+        self,
+        key: str,
+        factory: Callable[[], AsyncIterator[str]],
+        on_complete: Optional[Callable[[List[str]], None]] = None,
+    ) -> AsyncIterator[str]:
+        """Yield the chunks of the upstream stream for `key`, starting it if needed"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._produce(key, flight, factory, on_complete))
+            self.leaders += 1
+        else:
+            self.followers += 1
+
+        flight.subscribers += 1
+        try:
+            index = 0
+            while True:
+                if index < len(flight.chunks):
+                    yield flight.chunks[index]
+                    index += 1
+                elif flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    async with flight.changed:
+                        await flight.changed.wait_for(lambda: index < len(flight.chunks) or flight.done)
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # Nobody is listening any more: stop paying for the upstream call
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    async def _produce(self, key, flight, factory, on_complete):
+        try:
+            async for chunk in factory():
+                flight.chunks.append(chunk)
+                await flight.notify()
+            if on_complete is not None:
+                on_complete(flight.chunks)
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if flight.subscribers:
+                await flight.notify()
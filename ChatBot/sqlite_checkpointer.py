@@ -0,0 +1,368 @@
+"""
+Durable SQLite checkpointer for the chatbot graph.
+
+Keeps the latest checkpoint of every thread in a local SQLite database in
+WAL mode. Writes go to an in-memory buffer and a background thread commits
+them in batches (group commit), so a chat turn never waits on fsync. Reads
+check the buffer first and otherwise load just the requested thread's row,
+so nothing is loaded at startup.
+
+Only the latest checkpoint per thread is kept; checkpoint history (time
+travel) is not supported. Writes buffered in the last flush interval can be
+lost on a crash, but not on a clean shutdown.
+"""
+
+import asyncio
+import atexit
+import os
+import random
+import sqlite3
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT NOT NULL,
+    checkpoint BLOB NOT NULL,
+    metadata_type TEXT NOT NULL,
+    metadata BLOB NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT NOT NULL,
+    value BLOB NOT NULL,
+    task_path TEXT NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+# Statements are module constants so sqlite3's per-connection statement
+# cache reuses the prepared form on every call
+SELECT_CHECKPOINT = (
+    "SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata "
+    "FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?"
+)
+SELECT_CHECKPOINTS = (
+    "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, "
+    "metadata_type, metadata FROM checkpoints"
+)
+SELECT_WRITES = (
+    "SELECT task_id, idx, channel, type, value, task_path FROM writes "
+    "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx"
+)
+UPSERT_CHECKPOINT = "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+PRUNE_WRITES = "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id <> ?"
+REPLACE_WRITE = "INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+INSERT_WRITE = "INSERT OR IGNORE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+DELETE_THREAD_CHECKPOINTS = "DELETE FROM checkpoints WHERE thread_id = ?"
+DELETE_THREAD_WRITES = "DELETE FROM writes WHERE thread_id = ?"
+
+
+class SQLiteCheckpointer(BaseCheckpointSaver[str]):
+    """LangGraph checkpointer that group-commits the latest checkpoint per thread to SQLite"""
+
+    def __init__(self, path: str = "chatbot.sqlite3", *, flush_interval: float = 0.05,
+                 max_batch: int = 256, serde=None):
+        super().__init__(serde=serde)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.flushes = 0
+        self.flushed_rows = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, cached_statements=64)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._db_lock = threading.Lock()
+
+        # Write-behind buffer: (thread_id, checkpoint_ns) -> checkpoint row,
+        # plus buffered writes and thread deletions not yet committed
+        self._pending: Dict[Tuple[str, str], tuple] = {}
+        self._pending_writes: Dict[Tuple[str, str, str, str, int], tuple] = {}
+        self._pending_deletes: set = set()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, name="sqlite-checkpointer", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def from_env(cls) -> "SQLiteCheckpointer":
+        """Build a checkpointer from CHAT_SQLITE_* environment variables"""
+        return cls(
+            os.getenv('CHAT_SQLITE_PATH', 'chatbot.sqlite3'),
+            flush_interval=float(os.getenv('CHAT_SQLITE_FLUSH_INTERVAL', '0.05')),
+            max_batch=int(os.getenv('CHAT_SQLITE_MAX_BATCH', '256')),
+        )
+
+    # -- group commit -------------------------------------------------------
+
+    def _buffered(self) -> int:
+        return len(self._pending) + len(self._pending_writes) + len(self._pending_deletes)
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or self._buffered())
+                if self._closed:
+                    return
+                # Let a batch accumulate for one interval unless it fills up first
+                self._cond.wait_for(lambda: self._closed or self._buffered() >= self.max_batch,
+                                    timeout=self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Commit every buffered write in one transaction"""
+        with self._db_lock:
+            with self._cond:
+                deletes, self._pending_deletes = self._pending_deletes, set()
+                checkpoints, self._pending = self._pending, {}
+                writes, self._pending_writes = self._pending_writes, {}
+            if not (deletes or checkpoints or writes):
+                return
+            with self._conn:
+                for thread_id in deletes:
+                    self._conn.execute(DELETE_THREAD_CHECKPOINTS, (thread_id,))
+                    self._conn.execute(DELETE_THREAD_WRITES, (thread_id,))
+                self._conn.executemany(UPSERT_CHECKPOINT, checkpoints.values())
+                self._conn.executemany(PRUNE_WRITES, [row[:3] for row in checkpoints.values()])
+                self._conn.executemany(REPLACE_WRITE, [row for key, row in writes.items() if key[4] < 0])
+                self._conn.executemany(INSERT_WRITE, [row for key, row in writes.items() if key[4] >= 0])
+            self.flushes += 1
+            self.flushed_rows += len(deletes) + len(checkpoints) + len(writes)
+
+    def close(self):
+        """Stop the background flusher and commit anything still buffered"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join()
+        self.flush()
+        self._conn.close()
+        atexit.unregister(self.close)
+
+    # -- reads --------------------------------------------------------------
+
+    def _load_row(self, thread_id: str, checkpoint_ns: str) -> Optional[tuple]:
+        with self._cond:
+            if (thread_id, checkpoint_ns) in self._pending:
+                return self._pending[(thread_id, checkpoint_ns)]
+            if thread_id in self._pending_deletes:
+                return None
+        with self._db_lock:
+            row = self._conn.execute(SELECT_CHECKPOINT, (thread_id, checkpoint_ns)).fetchone()
+        return (thread_id, checkpoint_ns, *row) if row else None
+
+    def _load_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> list:
+        # Read the table and the buffer under _db_lock together (same order as
+        # flush()), so writes moved into SQLite in between are not lost
+        with self._db_lock:
+            rows = {
+                (task_id, idx): (task_id, channel, (type_, value))
+                for task_id, idx, channel, type_, value, _ in
+                self._conn.execute(SELECT_WRITES, (thread_id, checkpoint_ns, checkpoint_id))
+            }
+            with self._cond:
+                if thread_id in self._pending_deletes:
+                    rows = {}
+                for (t, ns, cid, task_id, idx), row in self._pending_writes.items():
+                    if (t, ns, cid) == (thread_id, checkpoint_ns, checkpoint_id):
+                        rows[(task_id, idx)] = (task_id, row[5], (row[6], row[7]))
+        return [(task_id, channel, self.serde.loads_typed(value))
+                for (task_id, channel, value) in (rows[key] for key in sorted(rows))]
+
+    def _to_tuple(self, row: tuple) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, type_, checkpoint, metadata_type, metadata = row
+        return CheckpointTuple(
+            config={"configurable": {
+                "thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id,
+            }},
+            checkpoint=self.serde.loads_typed((type_, checkpoint)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=(
+                {"configurable": {
+                    "thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_id,
+                }}
+                if parent_id else None
+            ),
+            pending_writes=self._load_writes(thread_id, checkpoint_ns, checkpoint_id),
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        """Load the latest checkpoint of a thread, or None"""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        row = self._load_row(thread_id, checkpoint_ns)
+        if row is None:
+            return None
+        checkpoint_id = get_checkpoint_id(config)
+        if checkpoint_id and checkpoint_id != row[2]:
+            return None  # Older checkpoints are not retained
+        return self._to_tuple(row)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        """List the latest checkpoint of each matching thread"""
+        if config:
+            row = self._load_row(config["configurable"]["thread_id"],
+                                 config["configurable"].get("checkpoint_ns", ""))
+            rows = [row] if row else []
+        else:
+            self.flush()
+            with self._db_lock:
+                rows = self._conn.execute(SELECT_CHECKPOINTS).fetchall()
+        before_id = get_checkpoint_id(before) if before else None
+        for row in rows:
+            if limit is not None and limit <= 0:
+                break
+            if before_id and row[2] >= before_id:
+                continue
+            checkpoint_tuple = self._to_tuple(row)
+            if filter and not all(checkpoint_tuple.metadata.get(k) == v for k, v in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield checkpoint_tuple
+
+    # -- writes -------------------------------------------------------------
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        """Buffer a checkpoint; it replaces the thread's previous one"""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        type_, payload = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_payload = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        row = (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+               type_, payload, metadata_type, metadata_payload)
+        with self._cond:
+            self._pending[(thread_id, checkpoint_ns)] = row
+            # Writes of superseded checkpoints are never read again
+            for key in [k for k in self._pending_writes
+                        if k[:2] == (thread_id, checkpoint_ns) and k[2] != checkpoint["id"]]:
+                del self._pending_writes[key]
+            self._cond.notify()
+        return {"configurable": {
+            "thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"],
+        }}
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        """Buffer intermediate writes for the thread's current checkpoint"""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = {}
+        for idx, (channel, value) in enumerate(writes):
+            idx = WRITES_IDX_MAP.get(channel, idx)
+            type_, payload = self.serde.dumps_typed(value)
+            rows[(thread_id, checkpoint_ns, checkpoint_id, task_id, idx)] = (
+                thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type_, payload, task_path,
+            )
+        with self._cond:
+            for key, row in rows.items():
+                if key[4] >= 0 and key in self._pending_writes:
+                    continue
+                self._pending_writes[key] = row
+            self._cond.notify()
+
+    def delete_thread(self, thread_id: str) -> None:
+        """Delete a thread's checkpoint and writes"""
+        with self._cond:
+            for key in [k for k in self._pending if k[0] == thread_id]:
+                del self._pending[key]
+            for key in [k for k in self._pending_writes if k[0] == thread_id]:
+                del self._pending_writes[key]
+            self._pending_deletes.add(thread_id)
+            self._cond.notify()
+
+    # -- async API: reads wait on _db_lock, which the flusher holds for a
+    # whole commit, so they run in a thread; writes only touch the buffer
+    # and stay inline ------------------------------------------------------
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: [*self.list(config, filter=filter, before=before, limit=limit)])
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        return self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return self.delete_thread(thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
@@ -0,0 +1,38 @@
+"""
+Server-Sent Event frame encoding for /chat/stream.
+
+Uses orjson when it is installed. Chunk frames are the hot path, so their
+constant parts are built once per stream and only the chunk text is
+serialized per frame.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # Optional speedup
+    orjson = None
+
+
+if orjson is not None:
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+else:
+    def dumps(obj) -> str:
+        return json.dumps(obj)
+
+
+def encode_event(data: dict) -> str:
+    """Encode one SSE frame"""
+    return f"data: {dumps(data)}\n\n"
+
+
+def chunk_encoder(session_id: str):
+    """Return a function encoding a chunk frame for `session_id` from the chunk text"""
+    prefix = 'data: {"type": "chunk", "content": '
+    suffix = f', "session_id": {dumps(session_id)}}}\n\n'
+
+    def encode(content: str) -> str:
+        return prefix + dumps(content) + suffix
+
+    return encode
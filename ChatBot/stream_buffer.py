@@ -0,0 +1,204 @@
+"""
+Resumable SSE streams for /chat/stream.
+
+Each streamed turn runs in a background task that appends numbered SSE
+frames to a StreamBuffer, and responses only read from the buffer. A client
+whose connection drops reconnects with `Last-Event-ID: <stream_id>:<seq>`
+and continues after that frame. This works both while the answer is still
+being generated and after it has finished, and it never calls the model a
+second time.
+
+Buffers are bounded. Each keeps at most `max_events` recent frames, and
+resuming from before them fails with StreamGone. Finished buffers are kept
+for `ttl` seconds, and at most `max_streams` of them. A stream that nobody
+is reading is cancelled, aborting the upstream call and keeping the partial
+answer. By default that happens as soon as the last reader leaves; a `grace`
+period keeps it generating for a client that may reconnect.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+
+class StreamGone(Exception):
+    """Raised when a stream, or the part of it a client asked for, is no longer buffered"""
+
+
+def parse_event_id(value: str) -> Tuple[str, int]:
+    """Split a `Last-Event-ID` into (stream_id, seq); raises ValueError if malformed"""
+    stream_id, _, seq = value.strip().rpartition(':')
+    if not stream_id or not seq.isdigit():
+        raise ValueError(f"Invalid event id '{value}'")
+    return stream_id, int(seq)
+
+
+class StreamBuffer:
+    """The numbered frames of one streamed turn"""
+
+    def __init__(self, stream_id: str, session_id: str, max_events: int):
+        self.stream_id = stream_id
+        self.session_id = session_id
+        self.max_events = max_events
+        self.frames = []
+        self.first_seq = 1  # seq of frames[0]
+        self.bytes = 0
+        self.done = False
+        self.readers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.idle_timer: Optional[asyncio.TimerHandle] = None
+        self._wakeup = asyncio.Event()
+
+    @property
+    def next_seq(self) -> int:
+        return self.first_seq + len(self.frames)
+
+    def append(self, frame: str):
+        """Number `frame` and wake the readers"""
+        frame = f"id: {self.stream_id}:{self.next_seq}\n{frame}"
+        self.frames.append(frame)
+        self.bytes += len(frame)
+        # Trim in batches so appending stays O(1) amortized
+        if self.max_events and len(self.frames) > self.max_events + self.max_events // 4:
+            drop = len(self.frames) - self.max_events
+            self.bytes -= sum(len(f) for f in self.frames[:drop])
+            del self.frames[:drop]
+            self.first_seq += drop
+        self._wake()
+
+    def finish(self):
+        self.done = True
+        self._wake()
+
+    def _wake(self):
+        self._wakeup.set()
+        self._wakeup = asyncio.Event()
+
+    async def read(self, after: int = 0) -> AsyncIterator[str]:
+        """Yield frames numbered above `after`, waiting for new ones until the stream is done"""
+        seq = after + 1
+        while True:
+            wakeup = self._wakeup
+            while seq < self.next_seq:
+                # A reader that falls too far behind loses its place
+                if seq < self.first_seq:
+                    raise StreamGone(f"Events before {self.first_seq} of stream {self.stream_id} were dropped")
+                yield self.frames[seq - self.first_seq]
+                seq += 1
+            if self.done:
+                return
+            await wakeup.wait()
+
+
+class StreamRegistry:
+    """Live and recently finished streams, by stream id"""
+
+    def __init__(self, max_streams: int = 1000, max_events: int = 4096, ttl_seconds: float = 60, grace_seconds: float = 0):
+        # max_events=0 keeps every frame; grace_seconds=0 cancels as soon as the last reader leaves
+        self.max_streams = max_streams
+        self.max_events = max_events
+        self.ttl_seconds = ttl_seconds
+        self.grace_seconds = grace_seconds
+        self._streams: Dict[str, StreamBuffer] = {}
+        self._finished: "OrderedDict[str, float]" = OrderedDict()
+        self.started = 0
+        self.resumed = 0
+        self.abandoned = 0
+        self.gone = 0
+
+    @classmethod
+    def from_env(cls) -> "StreamRegistry":
+        """Build a registry from CHAT_STREAM_RESUME_* environment variables"""
+        return cls(
+            max_streams=int(os.getenv('CHAT_STREAM_RESUME_STREAMS', '1000')),
+            max_events=int(os.getenv('CHAT_STREAM_RESUME_EVENTS', '4096')),
+            ttl_seconds=float(os.getenv('CHAT_STREAM_RESUME_TTL', '60')),
+            grace_seconds=float(os.getenv('CHAT_STREAM_RESUME_GRACE', '0')),
+        )
+
+    def start(self, stream_id: str, session_id: str, frames: AsyncIterator[str]) -> StreamBuffer:
+        """Run `frames` in the background, buffering every frame under `stream_id`"""
+        buffer = StreamBuffer(stream_id, session_id, self.max_events)
+        self._streams[stream_id] = buffer
+        buffer.task = asyncio.create_task(self._produce(buffer, frames))
+        self.started += 1
+        return buffer
+
+    def get(self, stream_id: str) -> StreamBuffer:
+        """The buffer for `stream_id`; raises StreamGone if it expired or never existed"""
+        self._expire()
+        buffer = self._streams.get(stream_id)
+        if buffer is None:
+            self.gone += 1
+            raise StreamGone(f"Stream {stream_id} is not available")
+        return buffer
+
+    async def follow(self, buffer: StreamBuffer, after: int = 0, resumed: bool = False) -> AsyncIterator[str]:
+        """Yield the frames a client has not seen yet; the stream survives this reader leaving"""
+        buffer.readers += 1
+        if buffer.idle_timer is not None:
+            buffer.idle_timer.cancel()
+            buffer.idle_timer = None
+        if resumed:
+            self.resumed += 1
+        try:
+            async for frame in buffer.read(after):
+                yield frame
+        except StreamGone:
+            self.gone += 1
+            raise
+        finally:
+            buffer.readers -= 1
+            if not buffer.readers and not buffer.done:
+                if self.grace_seconds:
+                    buffer.idle_timer = asyncio.get_running_loop().call_later(self.grace_seconds, self._abandon, buffer)
+                else:
+                    self._abandon(buffer)
+
+    @property
+    def detached(self) -> int:
+        """Streams still generating with no client reading them (inside the grace period)"""
+        return sum(1 for b in self._streams.values() if not b.done and not b.readers)
+
+    def stats(self) -> dict:
+        self._expire()
+        return {
+            'buffered': len(self._streams),
+            'running': len(self._streams) - len(self._finished),
+            'detached': self.detached,
+            'bytes': sum(b.bytes for b in self._streams.values()),
+            'started': self.started,
+            'resumed': self.resumed,
+            'abandoned': self.abandoned,
+            'gone': self.gone,
+        }
+
+    async def _produce(self, buffer: StreamBuffer, frames: AsyncIterator[str]):
+        try:
+            async for frame in frames:
+                buffer.append(frame)
+        finally:
+            buffer.finish()
+            if buffer.idle_timer is not None:
+                buffer.idle_timer.cancel()
+            self._finished[buffer.stream_id] = time.monotonic()
+            self._expire()
+
+    def _abandon(self, buffer: StreamBuffer):
+        # Nobody came back in time: stop paying for the upstream call
+        buffer.idle_timer = None
+        if not buffer.readers and not buffer.done:
+            self.abandoned += 1
+            buffer.task.cancel()
+
+    def _expire(self):
+        # Finished streams are in finishing order, so expired ones are at the front
+        now = time.monotonic()
+        while self._finished:
+            stream_id, finished = next(iter(self._finished.items()))
+            if len(self._finished) <= self.max_streams and now - finished < self.ttl_seconds:
+                break
+            del self._finished[stream_id]
+            self._streams.pop(stream_id, None)
@@ -0,0 +1,226 @@
+"""
+Long-term memory for long chat sessions: a per-session vector index of past turns.
+
+With CHAT_MEMORY=vector the model no longer sees every unsummarized message.
+It gets a fixed window of recent messages, plus the earlier turns most
+similar to the new question, plus the running summary when there is one.
+Prompt size therefore stays flat however long a session gets.
+
+Turns are embedded locally on the CPU by signed feature hashing of word
+unigrams and bigrams (no model files, no network). Each session's vectors
+live in one contiguous float32 array that grows by doubling. The index
+catches up with the history lazily when it is queried, so turns saved by
+/chat, /chat/stream, /chat/ws or loaded from the checkpointer are all
+covered without extra hooks. Any function mapping a list of texts to an
+(n, dim) array of unit vectors can replace the embedding.
+"""
+
+import os
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.messages import BaseMessage, SystemMessage
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+    a an and are as at be but by can could did do does for from had has have how i if in is it its
+    me my of on or our so than that the their them then there these they this to was we were what
+    when where which who why will with would you your about into just also not no yes please
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased words without stopwords and with a plural 's' stripped"""
+    words = []
+    for word in TOKEN_RE.findall(text.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+
+def hashing_embedding(texts: Sequence[str], dim: int = 512) -> np.ndarray:
+    """Unit vectors from signed feature hashing of word unigrams and bigrams"""
+    out = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        words = tokenize(text)
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        if not features:
+            continue
+        hashes = np.fromiter((zlib.crc32(f.encode()) for f in features), dtype=np.uint32, count=len(features))
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+        counts = np.bincount(hashes % dim, weights=signs, minlength=dim)
+        # Sublinear term frequency, so one repeated word cannot dominate a turn
+        vector = np.sign(counts) * np.log1p(np.abs(counts))
+        norm = np.linalg.norm(vector)
+        if norm:
+            out[row] = vector / norm
+    return out
+
+
+def turn_text(messages: Sequence[BaseMessage]) -> str:
+    return "\n".join(f"{'User' if m.type == 'human' else 'Assistant'}: {m.content}" for m in messages)
+
+
+class SessionIndex:
+    """Embeddings of one session's turns in contiguous arrays"""
+
+    def __init__(self, capacity: int = 16):
+        # Sized by the first batch, so any embedding width works
+        self.vectors: Optional[np.ndarray] = None
+        self.starts = np.zeros(capacity, dtype=np.int64)  # message index where each turn starts
+        self.ends = np.zeros(capacity, dtype=np.int64)
+        self.count = 0
+        self.indexed_to = 0  # messages before this index are covered
+        self.fingerprint: Optional[int] = None
+
+    def append(self, vectors: np.ndarray, starts: Sequence[int], ends: Sequence[int]):
+        """Add turns, growing the arrays by doubling when full"""
+        needed = self.count + len(vectors)
+        if self.vectors is None:
+            self.vectors = np.zeros((len(self.starts), vectors.shape[1]), dtype=np.float32)
+        if needed > len(self.vectors):
+            capacity = max(needed, 2 * len(self.vectors))
+            for name in ('vectors', 'starts', 'ends'):
+                old = getattr(self, name)
+                grown = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+                grown[:self.count] = old[:self.count]
+                setattr(self, name, grown)
+        self.vectors[self.count:needed] = vectors
+        self.starts[self.count:needed] = starts
+        self.ends[self.count:needed] = ends
+        self.count = needed
+
+    def search(self, query: np.ndarray, before: int, k: int, min_score: float) -> List[Tuple[int, float]]:
+        """Top-`k` (turn, cosine) among turns starting before message `before`"""
+        candidates = int(np.searchsorted(self.starts[:self.count], before))
+        if not candidates or k <= 0 or self.vectors is None:
+            return []
+        scores = self.vectors[:candidates] @ query
+        if candidates > k:
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(candidates)
+        return [(int(i), float(scores[i])) for i in top if scores[i] >= min_score]
+
+    @property
+    def bytes(self) -> int:
+        vectors = self.vectors.nbytes if self.vectors is not None else 0
+        return vectors + self.starts.nbytes + self.ends.nbytes
+
+
+class VectorMemory:
+    """Per-session vector indexes of past turns, bounded by session count"""
+
+    def __init__(
+        self,
+        top_k: int = 4,
+        recent_messages: int = 12,
+        min_score: float = 0.1,
+        dim: int = 512,
+        max_sessions: int = 10_000,
+        embed: Optional[Callable[[Sequence[str]], np.ndarray]] = None,
+    ):
+        if recent_messages < 1:
+            # The window must at least hold the message being answered
+            raise ValueError(f"CHAT_MEMORY_RECENT_MESSAGES must be at least 1, got {recent_messages}")
+        self.top_k = top_k
+        self.recent_messages = recent_messages
+        self.min_score = min_score
+        self.dim = dim
+        self.max_sessions = max_sessions
+        self.embed = embed or (lambda texts: hashing_embedding(texts, dim))
+        self._indexes: "OrderedDict[str, SessionIndex]" = OrderedDict()
+        self.recalls = 0
+        self.recall_seconds = 0.0
+        self.embedded_turns = 0
+
+    @classmethod
+    def from_env(cls) -> "VectorMemory":
+        """Build the memory from CHAT_MEMORY_* environment variables"""
+        return cls(
+            top_k=int(os.getenv('CHAT_MEMORY_TOP_K', '4')),
+            recent_messages=int(os.getenv('CHAT_MEMORY_RECENT_MESSAGES', '12')),
+            min_score=float(os.getenv('CHAT_MEMORY_MIN_SCORE', '0.1')),
+            dim=int(os.getenv('CHAT_MEMORY_DIM', '512')),
+            max_sessions=int(os.getenv('CHAT_MEMORY_MAX_SESSIONS', '10000')),
+        )
+
+    def tail_start(self, messages: Sequence[BaseMessage], summarized: int = 0) -> int:
+        """First message of the verbatim recent window, aligned to the start of a turn"""
+        start = max(summarized, len(messages) - self.recent_messages)
+        while summarized < start < len(messages) and messages[start].type != 'human':
+            start -= 1
+        return start
+
+    def recall(self, session_id: str, messages: Sequence[BaseMessage], before: int) -> List[Tuple[int, int]]:
+        """(start, end) message ranges of the earlier turns most relevant to the last user message"""
+        started = time.perf_counter()
+        index = self._sync(session_id, messages, before)
+        query = next((m for m in reversed(messages) if m.type == 'human'), None)
+        if query is None or not index.count:
+            return []
+        hits = index.search(self.embed([str(query.content)])[0], before, self.top_k, self.min_score)
+        self.recalls += 1
+        self.recall_seconds += time.perf_counter() - started
+        # Chronological order reads more naturally than score order
+        return sorted((int(index.starts[i]), int(index.ends[i])) for i, _ in hits)
+
+    def build_context(self, session_id: str, messages: Sequence[BaseMessage], summary: str, summarized: int) -> List[BaseMessage]:
+        """What the model sees: summary and recalled turns in one system message, then the recent window"""
+        start = self.tail_start(messages, summarized)
+        recalled = self.recall(session_id, messages, start)
+        parts = []
+        if summary:
+            parts.append(f"Summary of the earlier conversation:\n{summary}")
+        if recalled:
+            turns = "\n\n".join(turn_text(messages[a:b]) for a, b in recalled)
+            parts.append(f"Relevant earlier messages:\n{turns}")
+        head = [SystemMessage(content="\n\n".join(parts))] if parts else []
+        return head + list(messages[start:])
+
+    def delete(self, session_id: str):
+        self._indexes.pop(session_id, None)
+
+    def stats(self) -> dict:
+        return {
+            'sessions': len(self._indexes),
+            'turns': sum(i.count for i in self._indexes.values()),
+            'bytes': sum(i.bytes for i in self._indexes.values()),
+            'embedded_turns': self.embedded_turns,
+            'recalls': self.recalls,
+            'avg_recall_ms': round(self.recall_seconds / self.recalls * 1000, 3) if self.recalls else None,
+        }
+
+    def _sync(self, session_id: str, messages: Sequence[BaseMessage], upto: int) -> SessionIndex:
+        """Embed the complete turns in messages[:upto] that are not indexed yet"""
+        index = self._indexes.get(session_id)
+        fingerprint = zlib.crc32(str(messages[0].content).encode()) if messages else None
+        if index is None or index.indexed_to > len(messages) or index.fingerprint != fingerprint:
+            # New session, or the history was cleared and started over
+            index = SessionIndex()
+            index.fingerprint = fingerprint
+            self._indexes[session_id] = index
+        self._indexes.move_to_end(session_id)
+        while self.max_sessions and len(self._indexes) > self.max_sessions:
+            self._indexes.popitem(last=False)
+
+        starts, ends = [], []
+        turn_start = index.indexed_to
+        for i in range(index.indexed_to + 1, upto + 1):
+            if i == upto or messages[i].type == 'human':
+                if i > turn_start:
+                    starts.append(turn_start)
+                    ends.append(i)
+                turn_start = i
+        if starts:
+            index.append(self.embed([turn_text(messages[a:b]) for a, b in zip(starts, ends)]), starts, ends)
+            index.indexed_to = ends[-1]
+            self.embedded_turns += len(starts)
+        return index
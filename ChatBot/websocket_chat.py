@@ -0,0 +1,184 @@
+"""
+WebSocket chat protocol for /chat/ws.
+
+One connection carries every turn of a session, so chatty clients skip the
+per-turn HTTP request and SSE response. Frames are JSON text.
+
+Client to server:
+    {"type": "message", "content": "...", "id": <optional turn id>}
+    {"type": "cancel"}                 abort the turn in progress
+    {"type": "ping"} / {"type": "pong"}
+
+Server to client:
+    {"type": "session_start", "session_id": ...}
+    {"type": "chunk", "content": ..., "turn": ...}   (repeated)
+    {"type": "complete", "full_response": ..., "turn": ...}
+    {"type": "error", "error": ..., "turn": ..., "retry_after": ...}
+    {"type": "cancelled", "turn": ...}
+    {"type": "ping"}                   heartbeat; any frame counts as an answer
+
+Turns run one at a time in arrival order and a few more may wait. Outgoing
+frames pass through a bounded queue: a client that reads slowly pauses its
+own model stream instead of making the server buffer it. A client that
+stops reading entirely, or sits idle without answering heartbeats, is
+disconnected.
+"""
+
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Optional
+
+from starlette.websockets import WebSocket, WebSocketDisconnect, WebSocketState
+
+from sse import dumps
+
+
+@dataclass
+class WebSocketSettings:
+    heartbeat_seconds: float = 20.0
+    idle_timeout: float = 120.0  # no frames and no turn running
+    send_queue: int = 64  # frames buffered per connection
+    send_timeout: float = 30.0  # a single frame may take this long to send
+    max_pending: int = 8  # turns waiting behind the one in progress
+
+    @classmethod
+    def from_env(cls) -> "WebSocketSettings":
+        """Build settings from CHAT_WS_* environment variables"""
+        return cls(
+            heartbeat_seconds=float(os.getenv('CHAT_WS_HEARTBEAT', '20')),
+            idle_timeout=float(os.getenv('CHAT_WS_IDLE_TIMEOUT', '120')),
+            send_queue=int(os.getenv('CHAT_WS_SEND_QUEUE', '64')),
+            send_timeout=float(os.getenv('CHAT_WS_SEND_TIMEOUT', '30')),
+            max_pending=int(os.getenv('CHAT_WS_MAX_PENDING', '8')),
+        )
+
+
+class ChatConnection:
+    """One open /chat/ws connection"""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        session_id: str,
+        run_turn: Callable[[str, float], AsyncIterator[dict]],
+        settings: WebSocketSettings,
+        stats: dict,
+    ):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.run_turn = run_turn
+        self.settings = settings
+        self.stats = stats
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=settings.send_queue)
+        self.inbox: asyncio.Queue = asyncio.Queue(maxsize=settings.max_pending)
+        self.current: Optional[asyncio.Task] = None
+        self.last_seen = time.monotonic()
+        self.close_code: Optional[int] = None
+        self.close_reason = ""
+
+    async def run(self):
+        """Serve the connection until either side closes it"""
+        await self.websocket.send_text(dumps({'type': 'session_start', 'session_id': self.session_id}))
+        tasks = [asyncio.create_task(coro) for coro in (self._receive(), self._send(), self._turns(), self._heartbeat())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Cancelling _turns aborts the turn in progress; its partial answer is kept
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.close_code is not None and self.websocket.client_state == WebSocketState.CONNECTED:
+                try:
+                    await self.websocket.close(self.close_code, self.close_reason)
+                except (RuntimeError, OSError):
+                    pass
+
+    async def emit(self, frame: dict):
+        """Queue a frame for sending; waits while the client is behind"""
+        await self.outbox.put(frame)
+
+    async def _receive(self):
+        while True:
+            message = await self.websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            self.last_seen = time.monotonic()
+            try:
+                frame = json.loads(message.get('text') or message.get('bytes') or b'')
+                kind = frame.get('type')
+            except (ValueError, AttributeError):
+                await self.emit({'type': 'error', 'error': 'Frames must be JSON objects'})
+                continue
+
+            if kind == 'message':
+                content = frame.get('content')
+                if not isinstance(content, str) or not content.strip():
+                    await self.emit({'type': 'error', 'error': "'content' must be a non-empty string", 'turn': frame.get('id')})
+                    continue
+                try:
+                    self.inbox.put_nowait((frame.get('id'), content, time.perf_counter()))
+                except asyncio.QueueFull:
+                    await self.emit({'type': 'error', 'error': 'Too many pending messages', 'turn': frame.get('id')})
+            elif kind == 'cancel':
+                if self.current is not None:
+                    self.current.cancel()
+            elif kind == 'ping':
+                await self.emit({'type': 'pong'})
+            elif kind != 'pong':
+                await self.emit({'type': 'error', 'error': f"Unknown frame type '{kind}'"})
+
+    async def _send(self):
+        while True:
+            frame = await self.outbox.get()
+            try:
+                await asyncio.wait_for(self.websocket.send_text(dumps(frame)), self.settings.send_timeout)
+            except TimeoutError:
+                # The client stopped reading; do not hold its turn open forever
+                self.stats['closed_slow'] += 1
+                self.close_code, self.close_reason = 1013, "client too slow"
+                return
+            except (WebSocketDisconnect, RuntimeError, OSError):
+                return
+
+    async def _turns(self):
+        count = 0
+        while True:
+            turn_id, content, started = await self.inbox.get()
+            count += 1
+            turn = turn_id if turn_id is not None else count
+            self.current = asyncio.create_task(self._run_turn(turn, content, started))
+            try:
+                await self.current
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise  # The connection is closing
+                await self.emit({'type': 'cancelled', 'turn': turn})
+            except Exception as e:
+                await self.emit({'type': 'error', 'error': str(e), 'turn': turn})
+            finally:
+                self.current = None
+
+    async def _run_turn(self, turn, content: str, started: float):
+        self.stats['turns'] += 1
+        events = self.run_turn(content, started)
+        try:
+            async for event in events:
+                await self.emit({**event, 'turn': turn})
+        finally:
+            await events.aclose()
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.settings.heartbeat_seconds)
+            busy = self.current is not None or not self.inbox.empty()
+            if not busy and time.monotonic() - self.last_seen > self.settings.idle_timeout:
+                self.stats['closed_idle'] += 1
+                self.close_code, self.close_reason = 1000, "idle timeout"
+                return
+            try:
+                self.outbox.put_nowait({'type': 'ping'})
+            except asyncio.QueueFull:
+                pass  # The client is behind already; it will hear from us
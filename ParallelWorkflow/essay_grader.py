@@ -0,0 +1,331 @@
+"""
+Batch essay grading with the parallel evaluation graph from practice2.ipynb.
+
+The notebook grades one essay per `invoke`, and every node blocks on
+`structured_output.invoke`. Here the same graph has async nodes, and every
+model call waits on one semaphore shared by all essays. The limit applies to
+the whole batch rather than to each essay. Essays are read lazily from a
+JSONL file, and only a bounded number are in flight at a time. Each result
+is written as soon as its essay finishes, so thousands of essays can be
+graded in constant memory, and an interrupted run keeps its output.
+
+    python essay_grader.py essays.jsonl -o grades.jsonl --concurrency 16
+    python essay_grader.py essays.jsonl --fake --fake-latency 0.5   # offline dry run
+
+Input lines look like `{"id": "a1", "essay": "..."}`; `id` defaults to the
+line number. Output lines hold the id, the three criterion feedbacks, the
+individual scores, their average and the overall evaluation. Essays that
+fail after retries are written with an `error` instead.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import operator
+import sys
+import time
+from contextlib import aclosing
+from typing import Annotated, AsyncIterator, Iterable, Iterator, TextIO, TypedDict
+
+from langgraph.graph import END, START, StateGraph
+from langgraph.types import RetryPolicy
+from pydantic import BaseModel, Field
+
+
+class EvaluationSchema(BaseModel):
+    feedback: str = Field(description="Detailed feedback for the essay")
+    score: int = Field(description="Score for the essay", ge=0, le=10)
+
+
+class TestState(TypedDict, total=False):
+    essay: str
+    language_feedback: str
+    analysis_feedback: str
+    clarity_feedback: str
+    overall_feedback: str
+    individual_score: Annotated[list[int], operator.add]
+    avg_score: float
+    overall_score: int
+
+
+LANGUAGE_PROMPT = """
+Please evaluate the following essay and provide detailed feedback and a score out of 10.
+
+ESSAY:
+{essay}
+
+EVALUATION:
+"""
+
+ANALYSIS_PROMPT = """
+Please evaluate the analytical depth and structure of the following essay and provide detailed feedback and a score out of 10.
+
+ESSAY:
+{essay}
+
+EVALUATION:
+"""
+
+CLARITY_PROMPT = """
+Please evaluate the clarity and coherence of the following essay and provide detailed feedback and a score out of 10.
+
+ESSAY:
+{essay}
+
+EVALUATION:
+"""
+
+OVERALL_PROMPT = """
+Based on the following evaluations, provide comprehensive overall feedback:
+
+Language Feedback:
+{language_feedback}
+
+Analysis Feedback:
+{analysis_feedback}
+
+Clarity Feedback:
+{clarity_feedback}
+
+ESSAY:
+{essay}
+
+Please provide:
+1. Overall assessment
+2. Key strengths
+3. Areas for improvement
+4. Final thoughts
+"""
+
+RESULT_KEYS = ('language_feedback', 'analysis_feedback', 'clarity_feedback', 'overall_feedback',
+               'individual_score', 'avg_score', 'overall_score')
+
+
+class FakeEvaluator:
+    """Offline stand-in for the structured Gemini model, for dry runs and throughput tests"""
+
+    def __init__(self, latency: float = 0.5):
+        self.latency = latency
+
+    async def ainvoke(self, prompt: str) -> EvaluationSchema:
+        await asyncio.sleep(self.latency)
+        digest = hashlib.blake2b(prompt.encode(), digest_size=2).digest()
+        return EvaluationSchema(feedback=f"Feedback {digest.hex()}", score=digest[0] % 11)
+
+
+class LimitedEvaluator:
+    """Structured model calls behind one concurrency limit shared by the whole batch"""
+
+    def __init__(self, structured_output, concurrency: int):
+        self.structured_output = structured_output
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.calls = 0
+        self.call_seconds = 0.0
+
+    async def evaluate(self, prompt: str) -> EvaluationSchema:
+        async with self.semaphore:
+            started = time.perf_counter()
+            try:
+                return await self.structured_output.ainvoke(prompt)
+            finally:
+                self.calls += 1
+                self.call_seconds += time.perf_counter() - started
+
+
+def build_workflow(evaluator: LimitedEvaluator, retries: int = 3):
+    """The practice2.ipynb graph with async nodes calling `evaluator`"""
+
+    async def evaluate_language(state: TestState):
+        output = await evaluator.evaluate(LANGUAGE_PROMPT.format(essay=state['essay']))
+        # The notebook returned 'language_score', which is not a state key,
+        # so the language score never reached the average
+        return {'language_feedback': output.feedback, 'individual_score': [output.score]}
+
+    async def evaluate_analysis(state: TestState):
+        output = await evaluator.evaluate(ANALYSIS_PROMPT.format(essay=state['essay']))
+        return {'analysis_feedback': output.feedback, 'individual_score': [output.score]}
+
+    async def evaluate_thought(state: TestState):
+        output = await evaluator.evaluate(CLARITY_PROMPT.format(essay=state['essay']))
+        return {'clarity_feedback': output.feedback, 'individual_score': [output.score]}
+
+    async def final_evaluation(state: TestState):
+        scores = state.get('individual_score', [])
+        avg_score = sum(scores) / len(scores) if scores else 0
+        output = await evaluator.evaluate(OVERALL_PROMPT.format(
+            language_feedback=state.get('language_feedback', 'No language feedback available'),
+            analysis_feedback=state.get('analysis_feedback', 'No analysis feedback available'),
+            clarity_feedback=state.get('clarity_feedback', 'No clarity feedback available'),
+            essay=state['essay'],
+        ))
+        # Kept apart from individual_score so the average covers the three criteria only
+        return {'overall_feedback': output.feedback, 'avg_score': avg_score, 'overall_score': output.score}
+
+    retry = RetryPolicy(max_attempts=retries)
+    graph = StateGraph(TestState)
+    graph.add_node('evaluate_language', evaluate_language, retry_policy=retry)
+    graph.add_node('evaluate_analysis', evaluate_analysis, retry_policy=retry)
+    graph.add_node('evaluate_thought', evaluate_thought, retry_policy=retry)
+    graph.add_node('final_evaluation', final_evaluation, retry_policy=retry)
+    graph.add_edge(START, 'evaluate_language')
+    graph.add_edge(START, 'evaluate_analysis')
+    graph.add_edge(START, 'evaluate_thought')
+    graph.add_edge('evaluate_language', 'final_evaluation')
+    graph.add_edge('evaluate_analysis', 'final_evaluation')
+    graph.add_edge('evaluate_thought', 'final_evaluation')
+    graph.add_edge('final_evaluation', END)
+    return graph.compile()
+
+
+def read_essays(lines: Iterable[str]) -> Iterator[dict]:
+    """Parse JSONL essays lazily, giving each an id; bad lines become error results"""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield {'id': number, 'error': f"Line {number}: invalid JSON: {e}"}
+            continue
+        if not isinstance(record, dict) or not isinstance(record.get('essay'), str):
+            essay_id = record.get('id', number) if isinstance(record, dict) else number
+            yield {'id': essay_id, 'error': f"Line {number}: expected an object with an 'essay' string"}
+            continue
+        record.setdefault('id', number)
+        yield record
+
+
+async def grade_one(workflow, record: dict) -> dict:
+    try:
+        state = await workflow.ainvoke({'essay': record['essay']})
+    except Exception as e:
+        return {'id': record['id'], 'error': f"{type(e).__name__}: {e}"}
+    return {'id': record['id'], **{key: state.get(key) for key in RESULT_KEYS}}
+
+
+async def grade_essays(workflow, essays: Iterable[dict], max_pending: int) -> AsyncIterator[dict]:
+    """Grade essays concurrently, yielding results in completion order"""
+    essays = iter(essays)
+    pending = set()
+    try:
+        while True:
+            # Keep the window full without reading the whole input
+            while len(pending) < max_pending:
+                record = next(essays, None)
+                if record is None:
+                    break
+                if 'essay' not in record:
+                    yield record  # An input line that could not be read
+                    continue
+                pending.add(asyncio.ensure_future(grade_one(workflow, record)))
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        # Stopped early (error, Ctrl-C, consumer gone): don't leave essays running
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+def build_structured_output(model: str):
+    """Gemini with structured output; the API key comes from GOOGLE_API_KEY"""
+    from dotenv import load_dotenv
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    load_dotenv()
+    return ChatGoogleGenerativeAI(model=model, temperature=1.0).with_structured_output(EvaluationSchema)
+
+
+def done_ids(path: str) -> set:
+    """Ids already graded in an existing output file"""
+    ids = set()
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                # A killed run can leave a half-written last line; that essay is graded again
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(result, dict) and 'id' in result and 'error' not in result:
+                    ids.add(result['id'])
+    except FileNotFoundError:
+        pass
+    return ids
+
+
+async def run(args, source: TextIO, out: TextIO, log: TextIO = sys.stderr) -> dict:
+    """Grade every essay in `source`, writing one JSON line per essay to `out`"""
+    structured_output = FakeEvaluator(args.fake_latency) if args.fake else build_structured_output(args.model)
+    evaluator = LimitedEvaluator(structured_output, args.concurrency)
+    workflow = build_workflow(evaluator, args.retries)
+    skip = done_ids(args.output) if args.resume and args.output else set()
+    essays = (r for r in read_essays(source) if r['id'] not in skip)
+
+    started = time.perf_counter()
+    graded = failed = 0
+    results = grade_essays(workflow, essays, args.max_pending or args.concurrency * 2)
+    async with aclosing(results):
+        async for result in results:
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            failed += 'error' in result
+            graded += 1
+            if args.progress and graded % args.progress == 0:
+                elapsed = time.perf_counter() - started
+                print(f"{graded} essays, {failed} failed, {graded / elapsed * 60:.1f} essays/min", file=log)
+
+    elapsed = time.perf_counter() - started
+    report = {
+        'essays': graded,
+        'failed': failed,
+        'skipped': len(skip),
+        'seconds': round(elapsed, 3),
+        'essays_per_minute': round(graded / elapsed * 60, 1) if elapsed else None,
+        'model_calls': evaluator.calls,
+        'avg_call_seconds': round(evaluator.call_seconds / evaluator.calls, 3) if evaluator.calls else None,
+        'concurrency': args.concurrency,
+    }
+    print(json.dumps(report), file=log)
+    return report
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Grade a JSONL file of essays with the parallel evaluation graph")
+    parser.add_argument("input", help="JSONL file with one {\"id\", \"essay\"} object per line ('-' for stdin)")
+    parser.add_argument("-o", "--output", help="JSONL file for the results (default: stdout)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Model calls in flight across all essays")
+    parser.add_argument("--max-pending", type=int, default=0, help="Essays in flight (default: 2 x concurrency)")
+    parser.add_argument("--retries", type=int, default=3, help="Attempts per evaluation before an essay fails")
+    parser.add_argument("--model", default="gemini-2.0-flash", help="Gemini model name")
+    parser.add_argument("--resume", action="store_true", help="Append to --output, skipping essays already graded")
+    parser.add_argument("--progress", type=int, default=100, help="Report throughput every N essays (0 = off)")
+    parser.add_argument("--fake", action="store_true", help="Use an offline fake model instead of Gemini")
+    parser.add_argument("--fake-latency", type=float, default=0.5, help="Fake model seconds per call")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    out = open(args.output, 'a' if args.resume else 'w', encoding='utf-8') if args.output else sys.stdout
+    if args.resume and args.output and out.tell():
+        # Don't append to a half-written last line left by a killed run
+        with open(args.output, 'rb') as f:
+            f.seek(-1, 2)
+            if f.read(1) != b'\n':
+                out.write("\n")
+    try:
+        asyncio.run(run(args, source, out))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()